@@ -0,0 +1,35 @@
+"""Measure lookups of EventUid keys in a million-entry map.
+
+Run with `python benchmarks/event_uid.py`.
+"""
+
+import time
+
+from tgcf.storage import EventUid
+
+N = 1_000_000
+CHAT_ID = -1001234567890
+
+
+def main():
+    start = time.perf_counter()
+    stored = {EventUid(CHAT_ID, i): {i: i} for i in range(N)}
+    built = time.perf_counter() - start
+
+    keys = [EventUid(CHAT_ID, i) for i in range(0, 2 * N, 2)]
+    start = time.perf_counter()
+    hits = 0
+    for key in keys:
+        if stored.get(key) is not None:
+            hits += 1
+    looked_up = time.perf_counter() - start
+
+    print(f"built {N} entries in {built:.2f}s")
+    print(
+        f"{len(keys)} lookups ({hits} hits) in {looked_up:.2f}s, "
+        f"{len(keys) / looked_up / 1e6:.2f}M lookups/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Measure the per-message overhead of the plugin pipeline.
+
+Runs apply_plugins over fake messages with a filter and a replace plugin, and
+with the pipeline empty. Run with `python benchmarks/plugins.py`.
+"""
+
+import asyncio
+import time
+
+from tgcf import plugins
+from tgcf.plugin_models import Filters, Replace
+from tgcf.plugins import apply_plugins, compile_pipeline
+from tgcf.plugins.filter import TgcfFilter
+from tgcf.plugins.replace import TgcfReplace
+
+N = 100_000
+
+
+class FakeMessage:
+    """Just the attributes of a telethon Message that tgcf reads."""
+
+    audio = gif = video = video_note = sticker = contact = photo = document = None
+    media = entities = None
+    client = None
+    sender_id = 42
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.raw_text = text
+
+
+async def measure(label: str, messages) -> None:
+    start = time.perf_counter()
+    passed = 0
+    for message in messages:
+        if await apply_plugins(message):
+            passed += 1
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed / len(messages) * 1e6:.2f} us/message, {passed} passed")
+
+
+async def main():
+    blacklist = [f"spam{i}" for i in range(1000)]
+    loaded = {
+        "filter": TgcfFilter(Filters(check=True, text={"blacklist": blacklist})),
+        "replace": TgcfReplace(
+            Replace(check=True, text={f"brand{i}": f"ours{i}" for i in range(300)})
+        ),
+    }
+    messages = [
+        FakeMessage(f"message {i} about brand{i % 500} " * 5 + ("spam7" * (i % 10 > 0)))
+        for i in range(N)
+    ]
+
+    plugins.pipeline = compile_pipeline({})
+    await measure("no plugins", messages)
+    plugins.pipeline = compile_pipeline(loaded)
+    await measure("filter + replace", messages)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -46,7 +46,7 @@ async def forward_command_handler(event):
         except:
             pass
         CONFIG.forwards.append(forward)
-        config.from_to = await config.load_from_to(event.client, config.CONFIG.forwards)
+        await config.add_from_to(event.client, forward)
 
         await event.respond("Success")
         write_config(config.CONFIG)
@@ -78,7 +78,7 @@ async def remove_command_handler(event):
         parsed_args = yaml.safe_load(args)
         source_to_remove = parsed_args.get("source")
         CONFIG.forwards = remove_source(source_to_remove, config.CONFIG.forwards)
-        config.from_to = await config.load_from_to(event.client, config.CONFIG.forwards)
+        await config.remove_from_to(event.client, source_to_remove)
 
         await event.respond("Success")
         write_config(config.CONFIG)
@@ -0,0 +1,126 @@
+"""A bounded least-recently-used cache."""
+
+import sys
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional
+
+
+def approx_size(key: Any, value: Any) -> int:
+    """Estimate the memory taken by a cache entry, in bytes.
+
+    Counts the key, the value and, for dicts, their items (and the fields of
+    tuple items). Good enough for the small dicts used by the message mapping.
+    """
+    size = sys.getsizeof(key) + sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += sys.getsizeof(k) + sys.getsizeof(v)
+            if isinstance(v, tuple):
+                size += sum(sys.getsizeof(field) for field in v)
+    return size
+
+
+class LRUCache:
+    """Dict-like cache evicting the least recently used entries.
+
+    The cache is bounded by `max_entries` and/or `max_bytes` (0 means no bound),
+    the size of an entry being estimated by `sizeof`, and `on_evict` is called
+    with every evicted entry. Every operation is O(1).
+    `get` counts hits and misses and marks the entry as recently used,
+    while `in` and `peek` do neither.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 0,
+        max_bytes: int = 0,
+        sizeof: Callable[[Any, Any], int] = approx_size,
+        on_evict: Optional[Callable[[Any, Any], None]] = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.sizes: Dict[Hashable, int] = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value without touching recency or counters."""
+        return self.data.get(key, default)
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        if key in self.data:
+            self._discard(key)
+        self.data[key] = value
+        size = self.sizeof(key, value)
+        self.sizes[key] = size
+        self.nbytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        # the newest entry is kept even if it alone exceeds max_bytes
+        while len(self.data) > 1 and (
+            (self.max_entries and len(self.data) > self.max_entries)
+            or (self.max_bytes and self.nbytes > self.max_bytes)
+        ):
+            key, value = self.data.popitem(last=False)
+            self.nbytes -= self.sizes.pop(key)
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(key, value)
+
+    def _discard(self, key: Hashable) -> Any:
+        self.nbytes -= self.sizes.pop(key)
+        return self.data.pop(key)
+
+    def __delitem__(self, key: Hashable) -> None:
+        self._discard(key)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self.data:
+            return default
+        return self._discard(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self.data)
+
+    def clear(self) -> None:
+        self.data.clear()
+        self.sizes.clear()
+        self.nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return the size and the hit, miss and eviction counters."""
+        return {
+            "entries": len(self.data),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
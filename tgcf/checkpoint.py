@@ -0,0 +1,82 @@
+"""Remember how far past mode got, without rewriting the whole config.
+
+Progress is kept in a small json file, written atomically every few messages
+or seconds. For every forward it records the offset the job started from and
+the id of the last message forwarded. On resume, the recorded progress is used
+unless the offset in the config was changed meanwhile.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Dict
+
+from tgcf.config import Forward
+
+
+class Checkpoint:
+    def __init__(self, path: str, every: int, interval: float) -> None:
+        self.path = path
+        self.every = every
+        self.interval = interval
+        self.progress: Dict[str, Dict[str, int]] = self.load()
+        self.unsaved = 0
+        self.last_save = time.monotonic()
+
+    @staticmethod
+    def key(forward: Forward) -> str:
+        """Identify a forward by its source and destinations.
+
+        Many forwards can share a source, and they run in parallel.
+        """
+        dest = ",".join(sorted(str(d) for d in forward.dest))
+        return f"{forward.source}->{dest}"
+
+    def load(self) -> Dict[str, Dict[str, int]]:
+        try:
+            with open(self.path, encoding="utf8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except ValueError as err:
+            logging.warning(f"Ignoring unreadable checkpoint {self.path}. \n {err}")
+            return {}
+
+    def resume(self, forward: Forward) -> None:
+        """Set the offset of a forward to where the last run stopped."""
+        record = self.progress.get(self.key(forward))
+        if record and record["start"] == forward.offset:
+            logging.info(f"Resuming {forward.source} from id {record['offset']}")
+            forward.offset = record["offset"]
+        else:
+            self.progress[self.key(forward)] = {
+                "start": forward.offset,
+                "offset": forward.offset,
+            }
+
+    def update(self, forward: Forward, offset: int) -> None:
+        """Record progress, saving it once enough has accumulated."""
+        forward.offset = offset
+        self.progress[self.key(forward)]["offset"] = offset
+        self.unsaved += 1
+        if (
+            self.unsaved >= self.every
+            or time.monotonic() - self.last_save >= self.interval
+        ):
+            self.save()
+
+    def save(self) -> None:
+        """Write the progress atomically: a crash leaves either the old or new file."""
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf8") as file:
+            json.dump(self.progress, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.path)
+        self.unsaved = 0
+        self.last_save = time.monotonic()
+
+    def finish(self, forward: Forward) -> None:
+        """Mark a forward as done, once its offset is saved in the config."""
+        self.progress.pop(self.key(forward), None)
@@ -0,0 +1,193 @@
+"""Log in the accounts of tgcf, and spread the sends among them.
+
+Besides the main account (and the one of the sender plugin), extra bots or
+users can be listed in `login.pool`. A send then goes through any account that
+can post in the destination, the least busy one not waiting for a flood wait
+to end. So the flood limits of telegram, which are per account, are shared.
+
+Only sends to channels and supergroups, not replying, are moved: elsewhere
+message ids differ between accounts. The account that sent each message is
+recorded (see `tgcf.storage.Sent`), as only it can edit or delete it.
+"""
+
+import asyncio
+import logging
+import sys
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError, RPCError
+from telethon.tl import types
+
+from tgcf.config import CONFIG, get_SESSION
+from tgcf.ratelimit import limiter
+
+
+async def start_client(section: Any, default: str, **kwargs: Any) -> TelegramClient:
+    """Log in the account configured in a section (login, sender, pool)."""
+    client = TelegramClient(
+        get_SESSION(section, default),
+        CONFIG.login.API_ID,
+        CONFIG.login.API_HASH,
+        **kwargs,
+    )
+    if section.user_type == 0:
+        if section.BOT_TOKEN == "":
+            logging.warning(
+                f"Bot token not found for {default}, but login type is bot."
+            )
+            sys.exit()
+        await client.start(bot_token=section.BOT_TOKEN)
+    else:
+        await client.start()
+    return client
+
+
+async def can_send(client: TelegramClient, dest: int) -> Optional[bool]:
+    """Check if a pooled client can post in a chat. None if it can not be told now.
+
+    Private chats are left to the main account: a bot can not start a chat.
+    """
+    try:
+        entity = await client.get_entity(dest)
+        if isinstance(entity, types.User):
+            return False
+        perms = await client.get_permissions(entity, "me")
+    except FloodWaitError:
+        return None
+    except (RPCError, ValueError) as err:
+        logging.info(f"A pooled client can not send to {dest}. \n {err}")
+        return False
+    if perms.is_banned or perms.has_left:
+        return False
+    if getattr(entity, "broadcast", False):
+        return perms.post_messages
+    return True
+
+
+class ClientPool:
+    """The extra accounts, and the state of every account sending messages."""
+
+    def __init__(self) -> None:
+        self.clients: List[TelegramClient] = []
+        self.members: Dict[Tuple[int, int], bool] = {}  # (client, chat): can send
+        self.flooded: "weakref.WeakKeyDictionary[TelegramClient, float]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.busy: "weakref.WeakKeyDictionary[TelegramClient, int]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.used: "weakref.WeakKeyDictionary[TelegramClient, int]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.limits: "weakref.WeakKeyDictionary[TelegramClient, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.accounts: Dict[int, TelegramClient] = {}  # user id: client
+
+    async def start(self) -> None:
+        for i, account in enumerate(CONFIG.login.pool):
+            client = await start_client(account, f"tgcf_pool_{i}")
+            me = await client.get_me(input_peer=True)
+            self.clients.append(client)
+            self.accounts[me.user_id] = client
+        if self.clients:
+            logging.info(f"Started a pool of {len(self.clients)} extra clients")
+
+    async def stop(self) -> None:
+        for client in self.clients:
+            await client.disconnect()
+        self.clients = []
+        self.accounts = {}
+
+    def account(self, client: TelegramClient) -> int:
+        """Return the account recorded for messages sent by a client."""
+        for user_id, pooled in self.accounts.items():
+            if pooled is client:
+                return user_id
+        return 0
+
+    def client(self, account: int, default: TelegramClient) -> TelegramClient:
+        """Return the client of an account, `default` for 0 (or an unknown one)."""
+        client = self.accounts.get(account)
+        if client is None:
+            if account:
+                logging.warning(f"Account {account} is no longer in the pool")
+            return default
+        return client
+
+    def limit(self, client: TelegramClient) -> asyncio.Semaphore:
+        """Return the semaphore capping concurrent sends through a client."""
+        limit = self.limits.get(client)
+        if limit is None:
+            limit = asyncio.Semaphore(CONFIG.live.max_concurrent_sends)
+            self.limits[client] = limit
+        return limit
+
+    async def _is_member(self, client: TelegramClient, dest: int) -> bool:
+        key = (id(client), dest)
+        member = self.members.get(key)
+        if member is None:
+            member = await can_send(client, dest)
+            if member is None:
+                return False
+            self.members[key] = member
+        return member
+
+    async def pick(self, dest: int, default: TelegramClient) -> TelegramClient:
+        """Return the client to send through: not flooded, the least busy, and
+        the least used so far."""
+        candidates = [default]
+        for client in self.clients:
+            if client is not default and await self._is_member(client, dest):
+                candidates.append(client)
+        now = time.monotonic()
+        return min(
+            candidates,
+            key=lambda c: (
+                max(0, self.flooded.get(c, 0) - now),
+                self.busy.get(c, 0),
+                self.used.get(c, 0),
+            ),
+        )
+
+    async def call(
+        self,
+        dest: int,
+        default: TelegramClient,
+        movable: bool,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+    ) -> Any:
+        """Await func(client, *args) through a client of the pool, rate limited.
+
+        Messages that only `default` can send (like media it holds, or replies)
+        are not `movable`, and always go through it. At most
+        `live.max_concurrent_sends` calls are in flight per client.
+        On a flood wait, the client is left aside until the wait is over, and
+        the call is retried through another client, or the same after waiting.
+        """
+        if not self.clients:
+            async with self.limit(default):
+                return await limiter.call(default, dest, func, default, *args)
+        for attempt in range(limiter.settings.retries + 1):
+            client = await self.pick(dest, default) if movable else default
+            self.busy[client] = self.busy.get(client, 0) + 1
+            self.used[client] = self.used.get(client, 0) + 1
+            try:
+                async with self.limit(client):
+                    wait = self.flooded.get(client, 0) - time.monotonic()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    return await limiter.call_once(client, dest, func, client, *args)
+            except FloodWaitError as fwe:
+                if attempt == limiter.settings.retries:
+                    raise
+                self.flooded[client] = time.monotonic() + fwe.seconds
+            finally:
+                self.busy[client] -= 1
+
+
+pool = ClientPool()
@@ -1,5 +1,6 @@
 """Load all user defined config and env vars."""
 
+import asyncio
 import logging
 import os
 import sys
@@ -12,7 +13,8 @@ from telethon import TelegramClient
 from telethon.sessions import StringSession
 
 from tgcf import storage as stg
-from tgcf.const import CONFIG_FILE_NAME
+from tgcf.const import CONFIG_FILE_NAME, KEEP_LAST_MANY
+from tgcf.peers import PeerCache
 from tgcf.plugin_models import PluginConfig
 
 pwd = os.getcwd()
@@ -40,6 +42,21 @@ class LiveSettings(BaseModel):
     sequential_updates: bool = False
     delete_sync: bool = False
     delete_on_edit: Optional[str] = ".deleteMe"
+    concurrent_fanout: bool = False
+    max_concurrent_sends: int = 5
+    workers: int = 0  # 0: handle every update inline
+    queue_size: int = 100  # per source, 0: unbounded
+    queue_stats_interval: int = 60  # seconds, 0: never log queue depths
+
+    @validator("max_concurrent_sends")
+    def validate_max_concurrent_sends(
+        cls, val
+    ):  # pylint: disable=no-self-use,no-self-argument
+        """At least one send must be allowed at a time."""
+        if val < 1:
+            logging.warning("max_concurrent_sends must be at least 1")
+            val = 1
+        return val
 
 
 class PastSettings(BaseModel):
@@ -47,6 +64,31 @@ class PastSettings(BaseModel):
 
     # pylint: disable=too-few-public-methods
     delay: int = 0
+    batch_size: int = 100  # messages per request, when showing forwarded from
+    checkpoint_file: str = "tgcf.progress.json"
+    checkpoint_every: int = 100  # messages
+    checkpoint_interval: int = 10  # seconds
+    parallel_forwards: int = 4  # forwards backfilled at the same time
+    page_size: int = 100  # messages fetched per history request
+    buffer_size: int = 500  # messages fetched ahead of sending, per forward
+
+    @validator("parallel_forwards")
+    def validate_parallel_forwards(
+        cls, val
+    ):  # pylint: disable=no-self-use,no-self-argument
+        """At least one forward must run at a time."""
+        if val < 1:
+            logging.warning("parallel_forwards must be at least 1")
+            val = 1
+        return val
+
+    @validator("batch_size")
+    def validate_batch_size(cls, val):  # pylint: disable=no-self-use,no-self-argument
+        """Telegram forwards at most 100 messages per request."""
+        if val not in range(1, 101):
+            logging.warning("batch_size must be within 1 to 100")
+            val = min(max(val, 1), 100)
+        return val
 
     @validator("delay")
     def validate_delay(cls, val):  # pylint: disable=no-self-use,no-self-argument
@@ -60,6 +102,100 @@ class PastSettings(BaseModel):
         return val
 
 
+class RateLimitSettings(BaseModel):
+    """Limit how fast messages are sent, in requests per second. 0 means unlimited."""
+
+    # pylint: disable=too-few-public-methods
+    per_client: float = 20
+    per_dest: float = 0
+    min_rate: float = 0.05
+    backoff: float = 0.5  # the rate is multiplied by this on a flood wait
+    recover_after: int = 60  # seconds without flood wait before raising the rate
+    retries: int = 3  # times a send is retried after a flood wait
+
+    @validator("backoff")
+    def validate_backoff(cls, val):  # pylint: disable=no-self-use,no-self-argument
+        """The rate must go down on a flood wait."""
+        if not 0 < val < 1:
+            logging.warning("backoff must be between 0 and 1")
+            val = 0.5
+        return val
+
+
+class MappingSettings(BaseModel):
+    """Where to remember which message was sent for which, for edit, delete and reply syncs."""
+
+    # pylint: disable=too-few-public-methods
+    backend: str = "sqlite"  # sqlite or memory
+    path: str = "tgcf.mapping.db"
+    cache_size: int = KEEP_LAST_MANY
+    cache_bytes: int = 0  # approximate memory limit of the cache, 0: unbounded
+    ttl_days: int = 30  # 0: keep forever
+    batch_size: int = 100
+    flush_interval: int = 5  # seconds
+
+    @validator("backend")
+    def validate_backend(cls, val):  # pylint: disable=no-self-use,no-self-argument
+        """Fall back to the in-memory store for unknown backends."""
+        if val not in ("sqlite", "memory"):
+            logging.warning(f"Unknown mapping backend {val}, using memory")
+            val = "memory"
+        return val
+
+
+class MediaSettings(BaseModel):
+    """Caches avoiding to download or upload the same file again.
+
+    The disk cache is off unless `cache_bytes` is set, as it uses disk space.
+    """
+
+    # pylint: disable=too-few-public-methods
+    cache_dir: str = "tgcf.media"
+    cache_bytes: int = 0  # size limit of the downloaded files, 0: no cache
+    uploads: int = 1000  # uploaded files remembered per client, 0: none
+    upload_ttl: int = 3600  # seconds telegram is trusted to keep an upload
+
+
+class ExecutorSettings(BaseModel):
+    """Where plugins run their CPU heavy work, away from the event loop."""
+
+    # pylint: disable=too-few-public-methods
+    processes: int = 2  # jobs running at once, 0: use threads instead of processes
+    max_jobs: int = 4  # threads, when processes is 0
+    timeout: int = 300  # seconds
+
+    @validator("max_jobs")
+    def validate_max_jobs(cls, val):  # pylint: disable=no-self-use,no-self-argument
+        if val < 1:
+            logging.warning("executor.max_jobs must be at least 1, using 1")
+            val = 1
+        return val
+
+
+class PeerSettings(BaseModel):
+    """How the chats in the config are resolved to ids."""
+
+    # pylint: disable=too-few-public-methods
+    cache_file: str = "tgcf.peers.json"
+    ttl_days: int = 7  # 0: trust the cache forever
+    concurrency: int = 5  # peers resolved at the same time
+
+    @validator("concurrency")
+    def validate_concurrency(cls, val):  # pylint: disable=no-self-use,no-self-argument
+        if val < 1:
+            logging.warning("peers.concurrency must be at least 1, using 1")
+            val = 1
+        return val
+
+
+class PoolAccount(BaseModel):
+    """An extra account sending messages, see tgcf.clients."""
+
+    user_type: int = 0  # 0:bot, 1:user
+    BOT_TOKEN: str = ""
+    SESSION_STRING: str = ""
+
+
 class LoginConfig(BaseModel):
 
     API_ID: int = 0
@@ -69,6 +205,7 @@ class LoginConfig(BaseModel):
     USERNAME: str = ""
     SESSION_STRING: str = ""
     BOT_TOKEN: str = ""
+    pool: List[PoolAccount] = []
 
 
 class BotMessages(BaseModel):
@@ -86,9 +223,17 @@ class Config(BaseModel):
     admins: List[Union[int, str]] = []
     forwards: List[Forward] = []
     show_forwarded_from: bool = False
+    # copy media on telegram's side (a forward without author), when possible
+    server_copy: bool = True
+    group_albums: bool = True
     mode: int = 0  # 0: live, 1:past
     live: LiveSettings = LiveSettings()
     past: PastSettings = PastSettings()
+    mapping: MappingSettings = MappingSettings()
+    media: MediaSettings = MediaSettings()
+    executor: ExecutorSettings = ExecutorSettings()
+    peers: PeerSettings = PeerSettings()
+    rate_limit: RateLimitSettings = RateLimitSettings()
 
     plugins: PluginConfig = PluginConfig()
     bot_messages = BotMessages()
@@ -161,8 +306,35 @@ def get_env_var(name: str, optional: bool = False) -> str:
     return var
 
 
+def is_active(forward: Forward) -> bool:
+    """Check if a forward is enabled and has a source."""
+    if not forward.use_this:
+        return False
+    source = forward.source
+    return isinstance(source, int) or source.strip() != ""
+
+
 async def get_id(client: TelegramClient, peer):
-    return await client.get_peer_id(peer)
+    return await peer_cache.resolve(client, peer)
+
+
+async def resolve_all(client: TelegramClient, peers: List) -> Dict[Any, int]:
+    """Resolve many peers concurrently, each distinct one once.
+
+    Returns:
+        Dict: key = the peer as written in config
+                value = its chat id
+    """
+    limit = asyncio.Semaphore(CONFIG.peers.concurrency)
+
+    async def _(peer):
+        async with limit:
+            return await get_id(client, peer)
+
+    distinct = list(dict.fromkeys(peers))
+    ids = await asyncio.gather(*(_(peer) for peer in distinct))
+    peer_cache.save()
+    return dict(zip(distinct, ids))
 
 
 async def load_from_to(
@@ -183,27 +355,37 @@ async def load_from_to(
     -> But this mapping strictly contains signed integer chat ids
     -> Chat ids are essential for how storage is implemented
     -> Storage is essential for edit, delete and reply syncs
+    -> Peers are resolved concurrently, and cached (see tgcf.peers)
     """
+    active = [forward for forward in forwards if is_active(forward)]
+    ids = await resolve_all(
+        client, [peer for f in active for peer in [f.source, *f.dest]]
+    )
     from_to_dict = {}
-
-    async def _(peer):
-        return await get_id(client, peer)
-
-    for forward in forwards:
-        if not forward.use_this:
-            continue
-        source = forward.source
-        if not isinstance(source, int) and source.strip() == "":
-            continue
-        src = await _(forward.source)
-        from_to_dict[src] = [await _(dest) for dest in forward.dest]
+    for forward in active:
+        from_to_dict[ids[forward.source]] = [ids[dest] for dest in forward.dest]
     logging.info(f"From to dict is {from_to_dict}")
     return from_to_dict
 
 
+async def add_from_to(client: TelegramClient, forward: Forward) -> None:
+    """Add a single forward to from_to, without resolving the others again."""
+    if not is_active(forward):
+        return
+    ids = await resolve_all(client, [forward.source, *forward.dest])
+    from_to[ids[forward.source]] = [ids[dest] for dest in forward.dest]
+    logging.info(f"From to dict is {from_to}")
+
+
+async def remove_from_to(client: TelegramClient, source) -> None:
+    """Remove the forward of a single source from from_to."""
+    from_to.pop(await get_id(client, source), None)
+    logging.info(f"From to dict is {from_to}")
+
+
 async def load_admins(client: TelegramClient):
-    for admin in CONFIG.admins:
-        ADMINS.append(await get_id(client, admin))
+    ids = await resolve_all(client, CONFIG.admins)
+    ADMINS.extend(ids[admin] for admin in CONFIG.admins)
     logging.info(f"Loaded admins are {ADMINS}")
     return ADMINS
 
@@ -244,6 +426,7 @@ if PASSWORD == "tgcf":
     )
 from_to = {}
 is_bot: Optional[bool] = None
+peer_cache = PeerCache(CONFIG.peers.cache_file, CONFIG.peers.ttl_days)
 logging.info("config.py got executed")
 
 
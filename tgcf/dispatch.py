@@ -0,0 +1,108 @@
+"""Per-source work queues for live mode.
+
+Events of one source chat are handled strictly in the order they arrived,
+while events of different sources are handled in parallel by a pool of workers.
+A slow plugin working on one busy source thus no longer stalls the others.
+"""
+
+import asyncio
+import logging
+from typing import Any, Callable, Coroutine, Dict, List, Set, Tuple
+
+from tgcf import config
+
+Handler = Callable[[Any], Coroutine[Any, Any, None]]
+
+
+class Dispatcher:
+    """Route events into bounded per-source queues drained by a worker pool."""
+
+    def __init__(self, workers: int, queue_size: int, stats_interval: int) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self.stats_interval = stats_interval
+        self.queues: Dict[int, "asyncio.Queue[Tuple[Handler, Any]]"] = {}
+        # sources having pending events and not being handled by any worker
+        self.ready: "asyncio.Queue[int]" = asyncio.Queue()
+        self.scheduled: Set[int] = set()
+        self.processed = 0
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Spawn the workers. Must be called from a running event loop."""
+        for _ in range(self.workers):
+            self.tasks.append(asyncio.create_task(self._worker()))
+        if self.stats_interval > 0:
+            self.tasks.append(asyncio.create_task(self._report()))
+        logging.info(f"Started {self.workers} workers for live mode")
+
+    def wrap(self, handler: Handler) -> Handler:
+        """Return an event handler that queues the event for `handler`."""
+
+        async def enqueue(event) -> None:
+            chat_id = event.chat_id
+            if chat_id not in config.from_to:
+                return
+            await self.put(chat_id, handler, event)
+
+        return enqueue
+
+    async def put(self, chat_id: int, handler: Handler, event: Any) -> None:
+        """Queue an event of a source. Waits while the source's queue is full."""
+        queue = self.queues.get(chat_id)
+        if queue is None:
+            queue = asyncio.Queue(self.queue_size)
+            self.queues[chat_id] = queue
+        if queue.full():
+            logging.info(f"Queue for {chat_id} is full, waiting for workers")
+        await queue.put((handler, event))
+        if chat_id not in self.scheduled:
+            self.scheduled.add(chat_id)
+            self.ready.put_nowait(chat_id)
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self.ready.get()
+            queue = self.queues[chat_id]
+            handler, event = queue.get_nowait()
+            try:
+                await handler(event)
+            except Exception as err:
+                logging.exception(err)
+            finally:
+                queue.task_done()
+                self.processed += 1
+            # hand the source back, so that busy sources take turns
+            if queue.empty():
+                self.scheduled.discard(chat_id)
+            else:
+                self.ready.put_nowait(chat_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the queue depth of every source and overall counters."""
+        depths = {chat_id: q.qsize() for chat_id, q in self.queues.items()}
+        return {
+            "pending": sum(depths.values()),
+            "processed": self.processed,
+            "depths": depths,
+        }
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            stats = self.stats()
+            if stats["pending"]:
+                busy = {k: v for k, v in stats["depths"].items() if v}
+                logging.info(
+                    f"Live queues: {stats['pending']} pending, "
+                    f"{stats['processed']} processed, depths {busy}"
+                )
+
+    def stop(self) -> None:
+        """Cancel the workers."""
+        for task in self.tasks:
+            task.cancel()
+        self.tasks.clear()
+
+
+dispatcher: Dispatcher = None
@@ -0,0 +1,134 @@
+"""Edit the text of a message while keeping its formatting entities right.
+
+Telegram formats a message with entities (bold, links, ...) spanning parts of
+its plain text. Their offsets count UTF-16 code units, so an emoji counts as
+two. When a part of the text is replaced, the entities after it are shifted,
+those around it grow or shrink, and those inside it are dropped.
+"""
+
+import copy
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from telethon.extensions import markdown
+from telethon.tl import types
+from telethon.tl.types import TypeMessageEntity
+
+STYLE_ENTITIES = {
+    "bold": types.MessageEntityBold,
+    "italics": types.MessageEntityItalic,
+    "code": types.MessageEntityCode,
+    "strike": types.MessageEntityStrike,
+}
+
+
+class Edit(NamedTuple):
+    """Replace text[start:end] (python indices) by new, formatted by entities.
+
+    The offsets of the entities are relative to the start of new.
+    """
+
+    start: int
+    end: int
+    new: str
+    entities: Sequence[TypeMessageEntity] = ()
+
+
+def utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def style_entity(style: str, offset: int, length: int) -> Optional[TypeMessageEntity]:
+    """Return the entity applying a style (bold, italics, ...), None for plain."""
+    entity_class = STYLE_ENTITIES.get(style)
+    if entity_class is None:
+        return None
+    return entity_class(offset, length)
+
+
+def parse_markdown(text: str) -> Tuple[str, List[TypeMessageEntity]]:
+    """Parse markdown like telethon, but keep the whitespace around the text."""
+    raw_text, entities = markdown.parse(text)
+    stripped = text.lstrip()
+    lead = text[: len(text) - len(stripped)]
+    trail = stripped[len(stripped.rstrip()) :]
+    for entity in entities:
+        entity.offset += utf16_len(lead)
+    return f"{lead}{raw_text}{trail}", entities
+
+
+def sendable(entities: Sequence[TypeMessageEntity]) -> List[TypeMessageEntity]:
+    """Return entities that can be sent again, as received ones.
+
+    A mention of a user by name can not be sent as received, it becomes a link
+    to the user, as it did when going through markdown.
+    """
+    result = []
+    for entity in entities:
+        if isinstance(entity, types.MessageEntityMentionName):
+            entity = types.MessageEntityTextUrl(
+                entity.offset, entity.length, f"tg://user?id={entity.user_id}"
+            )
+        result.append(entity)
+    return result
+
+
+def _shift(pos: int, edits: List[Tuple[int, int, int]], is_start: bool) -> int:
+    """Return where a position of the original text moves to.
+
+    A position inside a replaced part goes to the end of the new text if it
+    starts an entity, and to its start if it ends one, so that an entity
+    never covers part of a replacement. Text inserted right after an entity
+    stays out of it.
+    """
+    delta = 0
+    for start, end, new_len in edits:
+        if end < pos or (end == pos and (is_start or start < end)):
+            delta += new_len - (end - start)
+        elif start < pos:
+            return start + delta + (new_len if is_start else 0)
+        else:
+            break
+    return pos + delta
+
+
+def apply_edits(
+    text: str, entities: Sequence[TypeMessageEntity], edits: Sequence[Edit]
+) -> Tuple[str, List[TypeMessageEntity]]:
+    """Apply edits, sorted and not overlapping, to a text and its entities."""
+    parts = []
+    edits16 = []  # the edits in utf-16 offsets: start, end and new length
+    added = []
+    last = 0
+    pos16 = 0
+    new_pos16 = 0
+    for edit in edits:
+        before = text[last : edit.start]
+        start16 = pos16 + utf16_len(before)
+        end16 = start16 + utf16_len(text[edit.start : edit.end])
+        new_len = utf16_len(edit.new)
+        new_start16 = new_pos16 + utf16_len(before)
+        parts.append(before)
+        parts.append(edit.new)
+        edits16.append((start16, end16, new_len))
+        for entity in edit.entities:
+            entity = copy.copy(entity)
+            entity.offset += new_start16
+            added.append(entity)
+        pos16 = end16
+        new_pos16 = new_start16 + new_len
+        last = edit.end
+    parts.append(text[last:])
+
+    shifted = []
+    for entity in entities:
+        start = _shift(entity.offset, edits16, True)
+        end = _shift(entity.offset + entity.length, edits16, False)
+        if end <= start:
+            continue
+        entity = copy.copy(entity)
+        entity.offset = start
+        entity.length = end - start
+        shifted.append(entity)
+    shifted.extend(added)
+    shifted.sort(key=lambda e: e.offset)
+    return "".join(parts), shifted
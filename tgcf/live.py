@@ -1,20 +1,29 @@
 """The module responsible for operating tgcf in live mode."""
 
+import asyncio
 import logging
 import os
-import sys
-from typing import Union
+from typing import Dict, List, Tuple, Union
 
 from telethon import TelegramClient, events, functions, types
 from telethon.sessions import StringSession
 from telethon.tl.custom.message import Message
 
-from tgcf import config, const
+from tgcf import config, const, dispatch
 from tgcf import storage as st
 from tgcf.bot import get_events
-from tgcf.config import CONFIG, get_SESSION
-from tgcf.plugins import apply_plugins, load_async_plugins
-from tgcf.utils import clean_session_files, send_message
+from tgcf.clients import pool, start_client
+from tgcf.config import CONFIG
+from tgcf.plugins import apply_plugins, load_async_plugins, plugins
+from tgcf.utils import clean_session_files, fan_out, record, send_album, send_message
+
+
+def sending_client(client: TelegramClient) -> TelegramClient:
+    """Return the client that sent the messages in the destinations."""
+    sender = plugins.get("sender")
+    if sender:
+        return sender.sender
+    return client
 
 
 async def new_message_handler(event: Union[Message, events.NewMessage]) -> None:
@@ -23,18 +32,12 @@ async def new_message_handler(event: Union[Message, events.NewMessage]) -> None:
 
     if chat_id not in config.from_to:
         return
-    logging.info(f"New message received in {chat_id}")
     message = event.message
+    if CONFIG.group_albums and message.grouped_id:
+        return  # handled by album_handler
+    logging.info(f"New message received in {chat_id}")
 
-    event_uid = st.EventUid(event)
-
-    length = len(st.stored)
-    exceeding = length - const.KEEP_LAST_MANY
-
-    if exceeding > 0:
-        for key in st.stored:
-            del st.stored[key]
-            break
+    event_uid = st.EventUid(chat_id, event.id)
 
     dest = config.from_to.get(chat_id)
 
@@ -42,19 +45,65 @@ async def new_message_handler(event: Union[Message, events.NewMessage]) -> None:
     if not tm:
         return
 
+    r_fwded_msgs = {}
     if event.is_reply:
-        r_event = st.DummyEvent(chat_id, event.reply_to_msg_id)
-        r_event_uid = st.EventUid(r_event)
+        r_event_uid = st.EventUid(chat_id, event.reply_to_msg_id)
+        r_fwded_msgs = st.reply_ids(r_event_uid)
+
+    if CONFIG.live.concurrent_fanout:
+        sent = await fan_out(dest, tm, r_fwded_msgs)
+        st.stored[event_uid] = {d: record(msg) for d, msg in sent.items()}
+        tm.clear()
+        return
 
-    st.stored[event_uid] = {}
+    fwded_msgs = {}
     for d in dest:
-        if event.is_reply and r_event_uid in st.stored:
-            tm.reply_to = st.stored.get(r_event_uid).get(d)
+        tm.reply_to = r_fwded_msgs.get(d)
         fwded_msg = await send_message(d, tm)
-        st.stored[event_uid].update({d: fwded_msg})
+        fwded_msgs[d] = record(fwded_msg)
+    st.stored[event_uid] = fwded_msgs
     tm.clear()
 
 
+async def album_handler(event: events.Album.Event) -> None:
+    """Process albums, sending each album as one group to every destination."""
+    chat_id = event.chat_id
+
+    if chat_id not in config.from_to:
+        return
+    logging.info(f"New album of {len(event.messages)} received in {chat_id}")
+
+    dest = config.from_to.get(chat_id)
+
+    tms = []
+    for message in event.messages:
+        tm = await apply_plugins(message)
+        if tm:
+            tms.append(tm)
+    if not tms:
+        return
+
+    first = tms[0].message
+    r_fwded_msgs = {}
+    if first.is_reply:
+        r_event_uid = st.EventUid(chat_id, first.reply_to_msg_id)
+        r_fwded_msgs = st.reply_ids(r_event_uid)
+
+    if CONFIG.live.concurrent_fanout:
+        sent = await fan_out(dest, tms, r_fwded_msgs)
+    else:
+        sent = {}
+        for d in dest:
+            sent[d] = await send_album(d, tms, reply_to=r_fwded_msgs.get(d))
+
+    for i, tm in enumerate(tms):
+        event_uid = st.EventUid(chat_id, tm.message.id)
+        st.stored[event_uid] = {
+            d: record(msgs[i]) for d, msgs in sent.items() if i < len(msgs) and msgs[i]
+        }
+        tm.clear()
+
+
 async def edited_message_handler(event) -> None:
     """Handle message edits."""
     message = event.message
@@ -66,7 +115,7 @@ async def edited_message_handler(event) -> None:
 
     logging.info(f"Message edited in {chat_id}")
 
-    event_uid = st.EventUid(event)
+    event_uid = st.EventUid(chat_id, event.id)
 
     tm = await apply_plugins(message)
 
@@ -76,12 +125,23 @@ async def edited_message_handler(event) -> None:
     fwded_msgs = st.stored.get(event_uid)
 
     if fwded_msgs:
-        for _, msg in fwded_msgs.items():
-            if config.CONFIG.live.delete_on_edit == message.text:
-                await msg.delete()
-                await message.delete()
-            else:
-                await msg.edit(tm.text)
+        # each copy is changed by the account that sent it
+        if config.CONFIG.live.delete_on_edit == message.text:
+            for d, sent in fwded_msgs.items():
+                client = pool.client(sent.account, tm.client)
+                await client.delete_messages(d, sent.msg_id)
+            await message.delete()
+            del st.stored[event_uid]
+        else:
+            for d, sent in fwded_msgs.items():
+                await pool.client(sent.account, tm.client).edit_message(
+                    d,
+                    sent.msg_id,
+                    tm.raw_text,
+                    formatting_entities=tm.entities,
+                    parse_mode=None,
+                )
+        tm.clear()
         return
 
     dest = config.from_to.get(chat_id)
@@ -97,18 +157,34 @@ async def deleted_message_handler(event):
     if chat_id not in config.from_to:
         return
 
-    logging.info(f"Message deleted in {chat_id}")
+    logging.info(f"Messages {event.deleted_ids} deleted in {chat_id}")
 
-    event_uid = st.EventUid(event)
-    fwded_msgs = st.stored.get(event_uid)
-    if fwded_msgs:
-        for _, msg in fwded_msgs.items():
-            await msg.delete()
+    deleted_uids = []
+    to_delete: Dict[Tuple[int, int], List[int]] = {}  # (dest, account): ids
+    for deleted_id in event.deleted_ids:
+        event_uid = st.EventUid(chat_id, deleted_id)
+        fwded_msgs = st.stored.get(event_uid)
+        if not fwded_msgs:
+            continue
+        deleted_uids.append(event_uid)
+        for d, sent in fwded_msgs.items():
+            to_delete.setdefault((d, sent.account), []).append(sent.msg_id)
+
+    if not to_delete:
         return
+    # telethon splits the ids into requests of 100
+    default = sending_client(event.client)
+    for (d, account), msg_ids in to_delete.items():
+        try:
+            await pool.client(account, default).delete_messages(d, msg_ids)
+        except Exception as err:
+            logging.error(f"Failed to delete messages {msg_ids} in {d}. \n {err}")
+    st.stored.remove(deleted_uids)
 
 
 ALL_EVENTS = {
     "new": (new_message_handler, events.NewMessage()),
+    "album": (album_handler, events.Album()),
     "edited": (edited_message_handler, events.MessageEdited()),
     "deleted": (deleted_message_handler, events.MessageDeleted()),
 }
@@ -122,31 +198,39 @@ async def start_sync() -> None:
     # load async plugins defined in plugin_models
     await load_async_plugins()
 
-    SESSION = get_SESSION()
-    client = TelegramClient(
-        SESSION,
-        CONFIG.login.API_ID,
-        CONFIG.login.API_HASH,
-        sequential_updates=CONFIG.live.sequential_updates,
+    st.stored = st.open_store(CONFIG.mapping)
+    flusher = asyncio.create_task(st.stored.keep_flushing())
+
+    client = await start_client(
+        CONFIG.login, "tgcf_bot", sequential_updates=CONFIG.live.sequential_updates
     )
-    if CONFIG.login.user_type == 0:
-        if CONFIG.login.BOT_TOKEN == "":
-            logging.warning("Bot token not found, but login type is set to bot.")
-            sys.exit()
-        await client.start(bot_token=CONFIG.login.BOT_TOKEN)
-    else:
-        await client.start()
+    await pool.start()
     config.is_bot = await client.is_bot()
     logging.info(f"config.is_bot={config.is_bot}")
     command_events = get_events()
 
     await config.load_admins(client)
 
-    ALL_EVENTS.update(command_events)
+    if CONFIG.live.workers > 0:
+        dispatch.dispatcher = dispatch.Dispatcher(
+            CONFIG.live.workers,
+            CONFIG.live.queue_size,
+            CONFIG.live.queue_stats_interval,
+        )
+        dispatch.dispatcher.start()
 
     for key, val in ALL_EVENTS.items():
         if config.CONFIG.live.delete_sync is False and key == "deleted":
             continue
+        if config.CONFIG.group_albums is False and key == "album":
+            continue
+        handler, event_builder = val
+        if dispatch.dispatcher:
+            handler = dispatch.dispatcher.wrap(handler)
+        client.add_event_handler(handler, event_builder)
+        logging.info(f"Added event handler for {key}")
+
+    for key, val in command_events.items():
         client.add_event_handler(*val)
         logging.info(f"Added event handler for {key}")
 
@@ -162,4 +246,9 @@ async def start_sync() -> None:
             )
         )
     config.from_to = await config.load_from_to(client, config.CONFIG.forwards)
-    await client.run_until_disconnected()
+    try:
+        await client.run_until_disconnected()
+    finally:
+        flusher.cancel()
+        st.stored.close()
+        await pool.stop()
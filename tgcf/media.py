@@ -0,0 +1,260 @@
+"""Copy the media of a message to another client, without a temporary file.
+
+The client that received the message downloads the file part by part. The parts
+go through a bounded queue to the sending client, which uploads each of them as
+soon as it arrives. So the upload starts before the download ends, and at most
+a few parts are held in memory, whatever the size of the file.
+
+Files are also cached by their telegram id, which stays the same when a file
+is posted again or forwarded: an uploaded file is sent again without uploading
+it, and a downloaded file is kept on disk for the next plugin needing it.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import shutil
+import time
+import weakref
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Tuple, Union
+
+from telethon import TelegramClient
+from telethon.tl import types
+from telethon.tl.custom.message import Message
+from telethon.tl.functions.upload import SaveBigFilePartRequest, SaveFilePartRequest
+
+from tgcf.cache import LRUCache
+from tgcf.config import CONFIG
+from tgcf.utils import cleanup, safe_name, stamp
+
+# the largest part telegram accepts, it divides both 1 MB and the download limit
+PART_SIZE = 512 * 1024
+# files larger than this must be uploaded as big files
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+InputMedia = Union[types.InputMediaUploadedPhoto, types.InputMediaUploadedDocument]
+
+
+async def _download(
+    message: Message, queue: "asyncio.Queue[Union[bytes, Exception, None]]"
+) -> None:
+    """Put the parts of the file in the queue, then None or the error that stopped."""
+    try:
+        async for part in message.client.iter_download(
+            message.media, chunk_size=PART_SIZE, request_size=PART_SIZE
+        ):
+            await queue.put(part)
+    except Exception as err:
+        await queue.put(err)
+        return
+    await queue.put(None)
+
+
+async def stream_media(
+    message: Message, client: TelegramClient, buffer_parts: int
+) -> Optional[InputMedia]:
+    """Upload the media of a message through another client.
+
+    Returns the uploaded media, ready to be sent by `client`, or None when the
+    media can not be streamed (its size is unknown).
+    """
+    size = message.file.size if message.file else None
+    if not size:
+        return None
+    total = (size + PART_SIZE - 1) // PART_SIZE
+    big = size > BIG_FILE_SIZE
+    file_id = random.getrandbits(63)
+    md5 = hashlib.md5()
+
+    queue = asyncio.Queue(buffer_parts)
+    downloader = asyncio.create_task(_download(message, queue))
+    index = 0
+    try:
+        while True:
+            part = await queue.get()
+            if part is None:
+                break
+            if isinstance(part, Exception):
+                raise part
+            if big:
+                request = SaveBigFilePartRequest(file_id, index, total, part)
+            else:
+                md5.update(part)
+                request = SaveFilePartRequest(file_id, index, part)
+            if not await client(request):
+                raise RuntimeError(f"Failed to upload part {index} of {message.id}")
+            index += 1
+    finally:
+        downloader.cancel()
+    if index != total:
+        raise RuntimeError(f"Got {index} parts of {message.id}, expected {total}")
+    logging.info(f"Streamed {size} bytes of media in message {message.id}")
+
+    name = message.file.name or f"{message.id}{message.file.ext or ''}"
+    if big:
+        uploaded = types.InputFileBig(file_id, total, name)
+    else:
+        uploaded = types.InputFile(file_id, total, name, md5.hexdigest())
+    if message.photo:
+        return types.InputMediaUploadedPhoto(uploaded)
+    document: types.Document = message.document
+    return types.InputMediaUploadedDocument(
+        uploaded, mime_type=document.mime_type, attributes=document.attributes
+    )
+
+
+def media_key(message: Message) -> Optional[Tuple[str, int]]:
+    """Return what identifies the file of a message, None if it has no file."""
+    if message.photo:
+        return ("photo", message.photo.id)
+    if message.document:
+        return ("document", message.document.id)
+    return None
+
+
+class KeyLocks:
+    """Let a single task at a time work on a key, like downloading a file."""
+
+    def __init__(self) -> None:
+        self.locks: Dict[Hashable, List] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self.locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[key]
+
+
+class UploadCache:
+    """Remember the files uploaded through each client, to send them again.
+
+    An upload is only trusted for `ttl` seconds, as telegram does not keep the
+    uploaded parts forever.
+    """
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.handles: "weakref.WeakKeyDictionary[TelegramClient, LRUCache]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.locks = KeyLocks()
+
+    def get(self, client: TelegramClient, key: Tuple[str, int]) -> Optional[InputMedia]:
+        handles = self.handles.get(client)
+        entry = handles.get(key) if handles else None
+        if entry is None:
+            return None
+        media, uploaded = entry
+        if time.monotonic() - uploaded > self.ttl:
+            del handles[key]
+            return None
+        return media
+
+    def put(
+        self, client: TelegramClient, key: Tuple[str, int], media: InputMedia
+    ) -> None:
+        handles = self.handles.get(client)
+        if handles is None:
+            handles = LRUCache(max_entries=self.max_entries)
+            self.handles[client] = handles
+        handles[key] = (media, time.monotonic())
+
+
+uploads = UploadCache(CONFIG.media.uploads, CONFIG.media.upload_ttl)
+
+
+async def upload_media(
+    message: Message, client: TelegramClient, buffer_parts: int
+) -> Optional[InputMedia]:
+    """Stream the media of a message to a client, unless it was uploaded already."""
+    key = media_key(message)
+    if key is None or not uploads.max_entries:
+        return await stream_media(message, client, buffer_parts)
+    async with uploads.locks.hold((id(client), key)):
+        media = uploads.get(client, key)
+        if media is not None:
+            logging.info(f"Reusing the upload of {key[0]} {key[1]}")
+            return media
+        media = await stream_media(message, client, buffer_parts)
+        if media is not None:
+            uploads.put(client, key, media)
+        return media
+
+
+PARTIAL = ".part"  # suffix of files being downloaded to the disk cache
+
+
+class DiskCache:
+    """Downloaded files, kept in a directory up to a total size.
+
+    The least recently used files are deleted first. A file is handed out as a
+    hard link (or a copy), which the caller may delete when done with it.
+    """
+
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.files = LRUCache(
+            max_bytes=max_bytes, sizeof=lambda _, size: size, on_evict=self._remove
+        )
+        self.locks = KeyLocks()
+        # files left by the last run, the oldest being evicted first
+        for entry in sorted(os.scandir(path), key=lambda e: e.stat().st_mtime):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(PARTIAL):
+                cleanup(entry.path)  # a download that did not complete
+            else:
+                self.files[entry.name] = entry.stat().st_size
+
+    def _remove(self, name: str, _size: int) -> None:
+        cleanup(os.path.join(self.path, name))
+
+    async def fetch(self, message: Message, key: Tuple[str, int], user: int) -> str:
+        """Return the path of a new link to the file, downloading it if needed."""
+        name = f"{key[0]}{key[1]}{message.file.ext or ''}"
+        cached = os.path.join(self.path, name)
+        async with self.locks.hold(name):
+            if self.files.get(name) is None:
+                # telethon leaves partial files behind, so only whole ones are
+                # moved into the cache
+                partial = f"{cached}{PARTIAL}"
+                try:
+                    await message.download_media(partial)
+                except BaseException:
+                    cleanup(partial)
+                    raise
+                os.replace(partial, cached)
+                self.files[name] = os.path.getsize(cached)
+            # like utils.stamp, so that plugins get the same kind of names
+            outf = safe_name(f"{user} {datetime.now()} {name}")
+            try:
+                os.link(cached, outf)
+            except OSError:
+                shutil.copyfile(cached, outf)
+        return outf
+
+
+_disk_cache: Optional[DiskCache] = None
+
+
+async def download_media(message: Message, user: int) -> str:
+    """Download the media of a message to a new file, going through the disk cache."""
+    global _disk_cache
+    key = media_key(message)
+    if key is None or not CONFIG.media.cache_bytes:
+        return stamp(await message.download_media(""), user)
+    if _disk_cache is None:
+        _disk_cache = DiskCache(CONFIG.media.cache_dir, CONFIG.media.cache_bytes)
+    return await _disk_cache.fetch(message, key, user)
@@ -6,7 +6,7 @@
 
 import asyncio
 import logging
-import time
+from typing import List, Optional, Union
 
 from telethon import TelegramClient
 from telethon.errors.rpcerrorlist import FloodWaitError
@@ -15,9 +15,11 @@ from telethon.tl.patched import MessageService
 
 from tgcf import config
 from tgcf import storage as st
+from tgcf.checkpoint import Checkpoint
+from tgcf.clients import pool
 from tgcf.config import CONFIG, get_SESSION, write_config
-from tgcf.plugins import apply_plugins, load_async_plugins
-from tgcf.utils import clean_session_files, send_message
+from tgcf.plugins import TgcfMessage, apply_plugins, load_async_plugins
+from tgcf.utils import clean_session_files, record, send_album, send_message
 
 
 async def forward_job() -> None:
@@ -25,61 +27,193 @@ async def forward_job() -> None:
     clean_session_files()
 
     # load async plugins defined in plugin_models
-    await load_async_plugins()    
+    await load_async_plugins()
 
     if CONFIG.login.user_type != 1:
         logging.warning(
             "You cannot use bot account for tgcf past mode. Telegram does not allow bots to access chat history."
         )
         return
+    st.stored = st.open_store(CONFIG.mapping)
+    progress = Checkpoint(
+        CONFIG.past.checkpoint_file,
+        CONFIG.past.checkpoint_every,
+        CONFIG.past.checkpoint_interval,
+    )
+    await pool.start()
+    try:
+        await _forward_all(progress)
+        # the offsets reached go to the config once, at the end
+        write_config(CONFIG, persist=False)
+        for forward in CONFIG.forwards:
+            progress.finish(forward)
+    finally:
+        progress.save()
+        st.stored.close()
+        await pool.stop()
+
+
+def can_join(tms: List[TgcfMessage], message: Message) -> bool:
+    """Check if a message can be sent in the same request as the pending ones."""
+    if CONFIG.show_forwarded_from and CONFIG.past.batch_size > 1:
+        return len(tms) < CONFIG.past.batch_size
+    if CONFIG.group_albums and message.grouped_id:
+        return message.grouped_id == tms[0].message.grouped_id
+    return False
+
+
+async def send_group(
+    d: int, tms: List[TgcfMessage], reply_to: Optional[int]
+) -> List[Message]:
+    """Send pending messages to one destination, waiting out any flood wait."""
+    while True:
+        try:
+            if len(tms) == 1:
+                return [await send_message(d, tms[0], reply_to=reply_to)]
+            return await send_album(d, tms, reply_to=reply_to)
+        except FloodWaitError as fwe:
+            logging.info(f"Sleeping for {fwe}")
+            await asyncio.sleep(delay=fwe.seconds)
+
+
+async def forward_group(src: int, dest: List[int], tms: List[TgcfMessage]) -> None:
+    """Send a message, an album or a batch of forwards to all destinations."""
+    first = tms[0].message
+    r_fwded_msgs = {}
+    if first.is_reply:
+        r_event_uid = st.EventUid(src, first.reply_to_msg_id)
+        r_fwded_msgs = st.reply_ids(r_event_uid)
+
+    sent = {}
+    for d in dest:
+        sent[d] = await send_group(d, tms, r_fwded_msgs.get(d))
+
+    for i, tm in enumerate(tms):
+        event_uid = st.EventUid(src, tm.message.id)
+        # other forwards of the same source may have stored their destinations
+        fwded_msgs = dict(st.stored.get(event_uid) or {})
+        fwded_msgs.update(
+            (d, record(msgs[i]))
+            for d, msgs in sent.items()
+            if i < len(msgs) and msgs[i]
+        )
+        st.stored[event_uid] = fwded_msgs
+        tm.clear()
+
+
+async def _forward(
+    src: int,
+    dest: List[int],
+    forward: config.Forward,
+    tms: List[TgcfMessage],
+    progress: Checkpoint,
+) -> int:
+    """Send pending messages of a forward, returning how many were sent.
+
+    Any error other than a flood wait stops the forward, before the checkpoint
+    goes past the messages: the next run sends them again.
+    """
+    await forward_group(src, dest, tms)
+    last_id = tms[-1].message.id
+    logging.info(f"forwarded {len(tms)} messages from {src} up to id = {last_id}")
+    progress.update(forward, last_id)
+    if CONFIG.past.delay:
+        await asyncio.sleep(CONFIG.past.delay)
+        logging.info(f"slept for {CONFIG.past.delay} seconds")
+    return len(tms)
+
+
+async def prefetch(
+    client: TelegramClient,
+    src: int,
+    forward: config.Forward,
+    queue: "asyncio.Queue[Union[Message, Exception, None]]",
+) -> None:
+    """Fetch the history of a source page by page, ahead of the sending.
+
+    Puts the messages in the queue, followed by None at the end, or by the
+    exception that stopped the fetching.
+    """
+    # max_id is exclusive, while forward.end is the last id to forward
+    max_id = forward.end + 1 if forward.end else 0
+    offset_id = forward.offset
+    try:
+        while True:
+            page = await client.get_messages(
+                src,
+                limit=CONFIG.past.page_size,
+                offset_id=offset_id,
+                max_id=max_id,
+                reverse=True,
+            )
+            if not page:
+                break
+            for message in page:
+                await queue.put(message)
+            offset_id = page[-1].id
+    except Exception as err:
+        await queue.put(err)
+        return
+    await queue.put(None)
+
+
+async def forward_chat(
+    client: TelegramClient,
+    src: int,
+    dest: List[int],
+    forward: config.Forward,
+    progress: Checkpoint,
+) -> None:
+    """Forward all existing messages of one source."""
+    count = 0
+    progress.resume(forward)
+    logging.info(f"Forwarding messages from {src} to {dest}")
+
+    queue = asyncio.Queue(CONFIG.past.buffer_size)
+    prefetcher = asyncio.create_task(prefetch(client, src, forward, queue))
+    tms: List[TgcfMessage] = []
+    try:
+        while True:
+            message = await queue.get()
+            if message is None:
+                break
+            if isinstance(message, Exception):
+                raise message
+            if isinstance(message, MessageService):
+                continue
+            if tms and not can_join(tms, message):
+                count += await _forward(src, dest, forward, tms, progress)
+                tms = []
+            tm = await apply_plugins(message)
+            if tm:
+                tms.append(tm)
+    finally:
+        prefetcher.cancel()
+    if tms:
+        count += await _forward(src, dest, forward, tms, progress)
+    logging.info(f"Done forwarding {count} messages from {src}")
+
+
+async def _forward_all(progress: Checkpoint) -> None:
     SESSION = get_SESSION()
     async with TelegramClient(
         SESSION, CONFIG.login.API_ID, CONFIG.login.API_HASH
     ) as client:
         config.from_to = await config.load_from_to(client, config.CONFIG.forwards)
         client: TelegramClient
-        for from_to, forward in zip(config.from_to.items(), config.CONFIG.forwards):
-            src, dest = from_to
-            last_id = 0
-            forward: config.Forward
-            logging.info(f"Forwarding messages from {src} to {dest}")
-            async for message in client.iter_messages(
-                src, reverse=True, offset_id=forward.offset
-            ):
-                message: Message
-                event = st.DummyEvent(message.chat_id, message.id)
-                event_uid = st.EventUid(event)
-
-                if forward.end and last_id > forward.end:
-                    continue
-                if isinstance(message, MessageService):
-                    continue
+        limit = asyncio.Semaphore(CONFIG.past.parallel_forwards)
+
+        async def _run(forward: config.Forward) -> None:
+            # resolve each forward itself, so that sources and forwards never
+            # get mismatched (the ids are cached, see tgcf.peers)
+            async with limit:
                 try:
-                    tm = await apply_plugins(message)
-                    if not tm:
-                        continue
-                    st.stored[event_uid] = {}
-
-                    if message.is_reply:
-                        r_event = st.DummyEvent(
-                            message.chat_id, message.reply_to_msg_id
-                        )
-                        r_event_uid = st.EventUid(r_event)
-                    for d in dest:
-                        if message.is_reply and r_event_uid in st.stored:
-                            tm.reply_to = st.stored.get(r_event_uid).get(d)
-                        fwded_msg = await send_message(d, tm)
-                        st.stored[event_uid].update({d: fwded_msg.id})
-                    tm.clear()
-                    last_id = message.id
-                    logging.info(f"forwarding message with id = {last_id}")
-                    forward.offset = last_id
-                    write_config(CONFIG, persist=False)
-                    time.sleep(CONFIG.past.delay)
-                    logging.info(f"slept for {CONFIG.past.delay} seconds")
-
-                except FloodWaitError as fwe:
-                    logging.info(f"Sleeping for {fwe}")
-                    await asyncio.sleep(delay=fwe.seconds)
+                    src = await config.get_id(client, forward.source)
+                    dest = [await config.get_id(client, d) for d in forward.dest]
+                    await forward_chat(client, src, dest, forward, progress)
                 except Exception as err:
-                    logging.exception(err)
+                    logging.error(f"Forwarding from {forward.source} stopped. \n {err}")
+
+        await asyncio.gather(
+            *(_run(forward) for forward in CONFIG.forwards if config.is_active(forward))
+        )
@@ -0,0 +1,91 @@
+"""Remember what the usernames and links in the config resolve to.
+
+Resolving a username costs a request, and telegram answers too many of them
+with flood waits. So for every account, the id and access hash of each peer
+written as a string (username, link, phone no) are kept in a json file. On the
+next start, they are given to the session of the client, which then knows the
+peer without asking telegram. A record is trusted for `ttl_days`, as usernames
+can change hands.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Union
+
+from telethon import TelegramClient, utils
+from telethon.tl import types
+
+
+def peer_key(peer: str) -> str:
+    return peer.strip().lower()
+
+
+def input_peer(peer_id: int, access_hash: int) -> types.TypeInputPeer:
+    """Rebuild the input peer of a marked id."""
+    raw_id, peer_type = utils.resolve_id(peer_id)
+    if peer_type is types.PeerUser:
+        return types.InputPeerUser(raw_id, access_hash)
+    if peer_type is types.PeerChannel:
+        return types.InputPeerChannel(raw_id, access_hash)
+    return types.InputPeerChat(raw_id)
+
+
+class PeerCache:
+    def __init__(self, path: str, ttl_days: int) -> None:
+        self.path = path
+        self.ttl = ttl_days * 24 * 3600
+        self.records: Dict[str, Dict[str, Dict[str, Any]]] = self.load()
+        self.changed = False
+
+    def load(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        try:
+            with open(self.path, encoding="utf8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except ValueError as err:
+            logging.warning(f"Ignoring unreadable peer cache {self.path}. \n {err}")
+            return {}
+
+    def get(self, account: int, peer: str) -> Optional[Dict[str, Any]]:
+        record = self.records.get(str(account), {}).get(peer_key(peer))
+        if record and self.ttl and time.time() - record["at"] > self.ttl:
+            return None
+        return record
+
+    def put(self, account: int, peer: str, peer_id: int, access_hash: int) -> None:
+        self.records.setdefault(str(account), {})[peer_key(peer)] = {
+            "id": peer_id,
+            "hash": access_hash,
+            "at": time.time(),
+        }
+        self.changed = True
+
+    def save(self) -> None:
+        """Write the cache atomically, if anything was added."""
+        if not self.changed:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf8") as file:
+            json.dump(self.records, file)
+        os.replace(tmp, self.path)
+        self.changed = False
+
+    async def resolve(self, client: TelegramClient, peer: Union[int, str]) -> int:
+        """Return the marked id of a peer, asking telegram only if not cached."""
+        if isinstance(peer, int):
+            return utils.get_peer_id(peer)
+        me = await client.get_me(input_peer=True)
+        record = self.get(me.user_id, peer)
+        if record:
+            # let the session know the peer, so that nothing is resolved later
+            client.session.process_entities([input_peer(record["id"], record["hash"])])
+            return record["id"]
+        entity = await client.get_input_entity(peer)
+        if isinstance(entity, types.InputPeerSelf):
+            return utils.get_peer_id(types.PeerUser(me.user_id))
+        peer_id = utils.get_peer_id(entity)
+        self.put(me.user_id, peer, peer_id, getattr(entity, "access_hash", 0))
+        return peer_id
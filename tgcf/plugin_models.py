@@ -63,6 +63,7 @@ class MarkConfig(BaseModel):
     image: str = "image.png"
     position: Position = Position.centre
     frame_rate: int = 15
+    scale: float = 0  # width of the overlay, relative to the media. 0: unscaled
 
 
 class OcrConfig(BaseModel):
@@ -86,6 +87,8 @@ class Sender(BaseModel):
     user_type: int = 0  # 0:bot, 1:user
     BOT_TOKEN: str = ""
     SESSION_STRING: str = ""
+    stream_media: bool = True  # copy media without a temporary file
+    buffer_parts: int = 8  # parts of 512 KB held in memory while streaming
 
 class PluginConfig(BaseModel):
     filter: Filters = Filters()
@@ -98,4 +101,4 @@ class PluginConfig(BaseModel):
 
 
 # List of plugins that need to load asynchronously
-ASYNC_PLUGIN_IDS = ['sender']
\ No newline at end of file
+ASYNC_PLUGIN_IDS = ['sender', 'mark']
\ No newline at end of file
@@ -4,41 +4,158 @@ Contains all the first-party tgcf plugins.
 """
 
 
+import asyncio
 import inspect
 import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from enum import Enum
 from importlib import import_module
-from typing import Any, Dict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
+from telethon.extensions import markdown
 from telethon.tl.custom.message import Message
+from telethon.tl.types import TypeMessageEntity
 
 from tgcf.config import CONFIG
+from tgcf.entities import Edit, apply_edits, sendable
+from tgcf.media import download_media
 from tgcf.plugin_models import FileType, ASYNC_PLUGIN_IDS
-from tgcf.utils import cleanup, stamp
+from tgcf.utils import cleanup
 
 PLUGINS = CONFIG.plugins
 
 
+_UNSET = object()
+
+
 class TgcfMessage:
+    """A message passing through the plugins.
+
+    The text is kept as plain `raw_text` and the `entities` formatting it, and
+    plugins change it with `edit` or `set_text`, so that it is never parsed
+    again. The markdown `text` is made only when asked for.
+    `raw_text`, `entities`, `sender_id` and `file_type` are read from the
+    telethon message only when first used, and then cached. Messages dropped
+    by a filter looking at `sender_id` never pay for reading the rest.
+    """
+
+    __slots__ = (
+        "message",
+        "client",
+        "new_file",
+        "cleanup",
+        "reply_to",
+        "file",
+        "transfer",
+        "text_changed",
+        "_raw_text",
+        "_entities",
+        "_sender_id",
+        "_file_type",
+    )
+
     def __init__(self, message: Message) -> None:
         self.message = message
-        self.text = self.message.text
-        self.raw_text = self.message.raw_text
-        self.sender_id = self.message.sender_id
-        self.file_type = self.guess_file_type()
+        self.client = message.client
         self.new_file = None
         self.cleanup = False
         self.reply_to = None
-        self.client = self.message.client
+        self.file = None
+        # set by a plugin deferring to send time the transfer of the media to
+        # self.client, as telegram may copy the media without it
+        self.transfer: Optional[
+            Union[Callable[["TgcfMessage"], Awaitable[None]], asyncio.Future]
+        ] = None
+        self.text_changed = False
+        self._raw_text = _UNSET
+        self._entities = _UNSET
+        self._sender_id = _UNSET
+        self._file_type = _UNSET
+
+    @property
+    def raw_text(self) -> str:
+        if self._raw_text is _UNSET:
+            self._raw_text = self.message.raw_text or ""
+        return self._raw_text
+
+    @property
+    def entities(self) -> List[TypeMessageEntity]:
+        if self._entities is _UNSET:
+            self._entities = sendable(self.message.entities or ())
+        return self._entities
+
+    def set_text(
+        self, raw_text: str, entities: Sequence[TypeMessageEntity] = ()
+    ) -> None:
+        """Replace the whole text, and its formatting."""
+        self._raw_text = raw_text
+        self._entities = list(entities)
+        self.text_changed = True
+
+    def edit(self, edits: Sequence[Edit]) -> None:
+        """Replace parts of the text, moving the formatting along."""
+        if not edits:
+            return
+        self.set_text(*apply_edits(self.raw_text, self.entities, edits))
+
+    def add_entities(self, entities: Sequence[TypeMessageEntity]) -> None:
+        """Format parts of the text, without changing it."""
+        if not entities:
+            return
+        merged = sorted([*self.entities, *entities], key=lambda e: e.offset)
+        self.set_text(self.raw_text, merged)
+
+    @property
+    def text(self) -> str:
+        """The text in markdown. Prefer raw_text and edit, which do not parse."""
+        return markdown.unparse(self.raw_text, self.entities)
+
+    @text.setter
+    def text(self, value: str) -> None:
+        self.set_text(*markdown.parse(value))
+
+    @property
+    def sender_id(self) -> int:
+        if self._sender_id is _UNSET:
+            self._sender_id = self.message.sender_id
+        return self._sender_id
+
+    @property
+    def file_type(self) -> FileType:
+        if self._file_type is _UNSET:
+            self._file_type = self.guess_file_type()
+        return self._file_type
 
     async def get_file(self) -> str:
         """Downloads the file in the message and returns the path where its saved."""
         if self.file_type == FileType.NOFILE:
             raise FileNotFoundError("No file exists in this message.")
-        self.file = stamp(await self.message.download_media(""), self.sender_id)
+        self.file = await download_media(self.message, self.sender_id)
         return self.file
 
+    async def fetch_media(self) -> None:
+        """Run the deferred transfer of the media, once even if sent concurrently."""
+        if self.transfer is None:
+            return
+        if not isinstance(self.transfer, asyncio.Future):
+            self.transfer = asyncio.ensure_future(self.transfer(self))
+        await asyncio.shield(self.transfer)
+
     def guess_file_type(self) -> FileType:
+        if not self.message.media:
+            return FileType.NOFILE
         for i in FileType:
             if i == FileType.NOFILE:
                 return i
@@ -52,8 +169,50 @@ class TgcfMessage:
             self.new_file = None
 
 
+_executor: Optional[Tuple[Executor, asyncio.Semaphore]] = None
+
+
+def get_executor() -> Tuple[Executor, asyncio.Semaphore]:
+    """Return the pool for CPU heavy work, and the semaphore capping its jobs.
+
+    The semaphore has one slot per worker, so that a job holding a slot is
+    running, not waiting in the queue of the pool.
+    """
+    global _executor
+    if _executor is None:
+        settings = CONFIG.executor
+        if settings.processes:
+            pool = ProcessPoolExecutor(settings.processes)
+            workers = settings.processes
+        else:
+            pool = ThreadPoolExecutor(settings.max_jobs)
+            workers = settings.max_jobs
+        _executor = (pool, asyncio.Semaphore(workers))
+    return _executor
+
+
+async def offload(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a CPU heavy function in the executor, without blocking the event loop.
+
+    The function and the args are sent to another process, so they must be
+    picklable: use a function defined at the top level of a module.
+    Raises asyncio.TimeoutError if the job runs longer than the timeout set in
+    config, not counting the wait for a free worker. The job is then abandoned,
+    but its worker stays busy, and keeps its slot, until the job finishes.
+    """
+    pool, limit = get_executor()
+    loop = asyncio.get_running_loop()
+    await limit.acquire()
+    job = pool.submit(func, *args)
+    # released when the worker is done, even if the job was abandoned
+    job.add_done_callback(lambda _: loop.call_soon_threadsafe(limit.release))
+    return await asyncio.wait_for(asyncio.wrap_future(job), CONFIG.executor.timeout)
+
+
 class TgcfPlugin:
     id_ = "plugin"
+    # the file types of the messages this plugin acts on, None for all messages
+    file_types: Optional[FrozenSet[FileType]] = None
 
     def __init__(self, data: Dict[str, Any]) -> None:  # TODO data type has changed
         self.data = data
@@ -61,11 +220,53 @@ class TgcfPlugin:
     async def __ainit__(self) -> None:
         """Asynchronous initialization here."""
 
+    def is_noop(self) -> bool:
+        """Return True if, as configured, the plugin never changes a message.
+
+        The pipeline is compiled once, so this must only look at config that
+        can not change while tgcf runs (unlike the style set by /style).
+        """
+        return False
+
     def modify(self, tm: TgcfMessage) -> TgcfMessage:
-        """Modify the message here."""
+        """Modify the message here.
+
+        CPU heavy work should be awaited through `offload`, in an async modify.
+        """
         return tm
 
 
+class Stage(NamedTuple):
+    """A plugin prepared for the pipeline applied to every message."""
+
+    id_: str
+    modify: Callable[[TgcfMessage], Any]
+    is_async: bool
+    file_types: Optional[FrozenSet[FileType]]
+
+
+def compile_pipeline(_plugins: Dict[str, TgcfPlugin]) -> List[Stage]:
+    """Turn the loaded plugins into the ordered stages of the pipeline.
+
+    Done once, so that nothing is introspected per message. Plugins that can
+    not change any message, as configured, are left out.
+    """
+    stages = []
+    for _id, plugin in _plugins.items():
+        if plugin.is_noop():
+            logging.info(f"Plugin {_id} has nothing to do, skipping it")
+            continue
+        stages.append(
+            Stage(
+                _id,
+                plugin.modify,
+                inspect.iscoroutinefunction(plugin.modify),
+                plugin.file_types,
+            )
+        )
+    return stages
+
+
 def load_plugins() -> Dict[str, TgcfPlugin]:
     """Load the plugins specified in config."""
     _plugins = {}
@@ -116,17 +317,21 @@ async def load_async_plugins() -> None:
 async def apply_plugins(message: Message) -> TgcfMessage:
     """Apply all loaded plugins to a message."""
     tm = TgcfMessage(message)
+    if not pipeline:
+        return tm
 
-    for _id, plugin in plugins.items():
+    for stage in pipeline:
+        if stage.file_types is not None and tm.file_type not in stage.file_types:
+            continue
         try:
-            if inspect.iscoroutinefunction(plugin.modify):
-                ntm = await plugin.modify(tm)
+            if stage.is_async:
+                ntm = await stage.modify(tm)
             else:
-                ntm = plugin.modify(tm)
+                ntm = stage.modify(tm)
         except Exception as err:
-            logging.error(f"Failed to apply plugin {_id}. \n {err} ")
+            logging.error(f"Failed to apply plugin {stage.id_}. \n {err} ")
         else:
-            logging.info(f"Applied plugin {_id}")
+            logging.debug(f"Applied plugin {stage.id_}")
             if not ntm:
                 tm.clear()
                 return None
@@ -134,3 +339,4 @@ async def apply_plugins(message: Message) -> TgcfMessage:
 
 
 plugins = load_plugins()
+pipeline = compile_pipeline(plugins)
@@ -1,5 +1,6 @@
 import logging
 
+from tgcf.entities import Edit, parse_markdown
 from tgcf.plugins import TgcfMessage, TgcfPlugin
 
 
@@ -8,8 +9,15 @@ class TgcfCaption(TgcfPlugin):
 
     def __init__(self, data) -> None:
         self.caption = data
+        # header and footer may use markdown, parsed once here
+        self.header = parse_markdown(self.caption.header)
+        self.footer = parse_markdown(self.caption.footer)
         logging.info(self.caption)
 
+    def is_noop(self) -> bool:
+        return not (self.caption.header or self.caption.footer)
+
     def modify(self, tm: TgcfMessage) -> TgcfMessage:
-        tm.text = f"{self.caption.header}{tm.text}{self.caption.footer}"
+        end = len(tm.raw_text)
+        tm.edit([Edit(0, 0, *self.header), Edit(end, end, *self.footer)])
         return tm
@@ -1,76 +1,141 @@
 import logging
-from typing import Any, Dict, List
-
-from pydantic import BaseModel  # pylint: disable=no-name-in-module
+import re
+from typing import List, Optional, Pattern, Set
 
 from tgcf.plugin_models import FileType, Filters, TextFilter
 from tgcf.plugins import TgcfMessage, TgcfPlugin
-from tgcf.utils import match
+
+BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+
+class PatternSet:
+    """Check whether any of many patterns occurs in a text.
+
+    The patterns are compiled once into a single alternation, so that a text is
+    scanned once and the search stops at the first hit. Regexes that can not be
+    merged (like those using backreferences) are kept apart, and invalid ones
+    are skipped.
+    """
+
+    def __init__(self, patterns: List[str], regex: bool, case_sensitive: bool) -> None:
+        flags = 0 if case_sensitive else re.IGNORECASE
+        if not regex:
+            patterns = [re.escape(pattern) for pattern in patterns]
+        merged = []
+        self.separate: List[Pattern] = []
+        for pattern in patterns:
+            try:
+                compiled = re.compile(pattern, flags)
+            except re.error as err:
+                logging.error(f"Invalid pattern {pattern} is ignored. \n {err}")
+                continue
+            if BACKREFERENCE.search(pattern):
+                self.separate.append(compiled)
+            else:
+                merged.append(pattern)
+
+        self.combined: Optional[Pattern] = None
+        if merged:
+            try:
+                self.combined = re.compile("|".join(f"(?:{p})" for p in merged), flags)
+            except re.error:
+                self.separate.extend(re.compile(p, flags) for p in merged)
+
+    def __bool__(self) -> bool:
+        return self.combined is not None or bool(self.separate)
+
+    def search(self, text: str) -> bool:
+        if self.combined and self.combined.search(text):
+            return True
+        return any(pattern.search(text) for pattern in self.separate)
+
+
+def user_ids(users: List[str]) -> Set[int]:
+    """Convert the user ids in a filter list to ints."""
+    ids = set()
+    for user in users:
+        try:
+            ids.add(int(user))
+        except ValueError:
+            logging.warning(f"Ignoring {user} in users filter, it is not a user id")
+    return ids
 
 
 class TgcfFilter(TgcfPlugin):
     id_ = "filter"
 
     def __init__(self, data) -> None:
-        self.filters = data
-        self.case_correct()
+        self.filters: Filters = data
+        self.compile()
         logging.info(self.filters)
 
-    def case_correct(self) -> None:
+    def compile(self) -> None:
+        """Prepare the filter lists for fast checks on every message."""
         textf: TextFilter = self.filters.text
-
-        if textf.case_sensitive is False and textf.regex is False:
-            textf.blacklist = [item.lower() for item in textf.blacklist]
-            textf.whitelist = [item.lower() for item in textf.whitelist]
+        self.text_blacklist = PatternSet(
+            textf.blacklist, textf.regex, textf.case_sensitive
+        )
+        self.text_whitelist = PatternSet(
+            textf.whitelist, textf.regex, textf.case_sensitive
+        )
+        self.user_blacklist = user_ids(self.filters.users.blacklist)
+        self.user_whitelist = user_ids(self.filters.users.whitelist)
+        self.file_blacklist: Set[FileType] = set(self.filters.files.blacklist)
+        self.file_whitelist: Set[FileType] = set(self.filters.files.whitelist)
+
+    def is_noop(self) -> bool:
+        return not (
+            self.text_blacklist
+            or self.text_whitelist
+            or self.user_blacklist
+            or self.user_whitelist
+            or self.file_blacklist
+            or self.file_whitelist
+        )
 
     def modify(self, tm: TgcfMessage) -> TgcfMessage:
 
         if self.users_safe(tm):
-            logging.info("Message passed users filter")
+            logging.debug("Message passed users filter")
             if self.files_safe(tm):
-                logging.info("Message passed files filter")
+                logging.debug("Message passed files filter")
                 if self.text_safe(tm):
-                    logging.info("Message passed text filter")
+                    logging.debug("Message passed text filter")
                     return tm
 
     def text_safe(self, tm: TgcfMessage) -> bool:
-        flist = self.filters.text
-
-        text = tm.text
-        if not flist.case_sensitive:
-            text = text.lower()
-        if not text and flist.whitelist == []:
+        if not self.text_blacklist and not self.text_whitelist:
+            return True  # without reading the text
+        text = tm.raw_text
+        if not text and not self.text_whitelist:
             return True
 
         # first check if any blacklisted pattern is present
-        for forbidden in flist.blacklist:
-            if match(forbidden, text, self.filters.text.regex):
-                return False  # when a forbidden pattern is found
+        if self.text_blacklist and self.text_blacklist.search(text):
+            return False  # when a forbidden pattern is found
 
-        if not flist.whitelist:
+        if not self.text_whitelist:
             return True  # if no whitelist is present
 
-        # if whitelist is present
-        for allowed in flist.whitelist:
-            if match(allowed, text, self.filters.text.regex):
-                return True  # only when atleast one whitelisted pattern is found
+        # only when atleast one whitelisted pattern is found
+        return self.text_whitelist.search(text)
 
     def users_safe(self, tm: TgcfMessage) -> bool:
-        flist = self.filters.users
-        sender = str(tm.sender_id)
-        if sender in flist.blacklist:
-            return False
-        if not flist.whitelist:
+        if not self.user_blacklist and not self.user_whitelist:
             return True
-        if sender in flist.whitelist:
+        sender = tm.sender_id
+        if sender in self.user_blacklist:
+            return False
+        if not self.user_whitelist:
             return True
+        return sender in self.user_whitelist
 
     def files_safe(self, tm: TgcfMessage) -> bool:
-        flist = self.filters.files
+        if not self.file_blacklist and not self.file_whitelist:
+            return True
         fl_type = tm.file_type
-        if fl_type in flist.blacklist:
+        if fl_type in self.file_blacklist:
             return False
-        if not flist.whitelist:
-            return True
-        if fl_type in flist.whitelist:
+        if not self.file_whitelist:
             return True
+        return fl_type in self.file_whitelist
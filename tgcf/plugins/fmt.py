@@ -4,7 +4,8 @@ from typing import Any, Dict
 
 from pydantic import BaseModel  # pylint: disable=no-name-in-module
 
-from tgcf.plugin_models import STYLE_CODES, Format, Style
+from tgcf.entities import style_entity, utf16_len
+from tgcf.plugin_models import Format, Style
 from tgcf.plugins import TgcfMessage, TgcfPlugin
 
 
@@ -15,12 +16,14 @@ class TgcfFmt(TgcfPlugin):
         self.format = data
         logging.info(self.format)
 
+    # no is_noop: the style can be changed while running, by the /style command
+
     def modify(self, tm: TgcfMessage) -> TgcfMessage:
-        if self.format.style is Style.PRESERVE:
+        if self.format.style == Style.PRESERVE:
             return tm
         msg_text: str = tm.raw_text
         if not msg_text:
             return tm
-        style = STYLE_CODES.get(self.format.style)
-        tm.text = f"{style}{msg_text}{style}"
+        entity = style_entity(self.format.style, 0, utf16_len(msg_text))
+        tm.set_text(msg_text, [entity] if entity else [])
         return tm
@@ -1,55 +1,112 @@
+import asyncio
 import logging
 import os
-import shutil
-from typing import Any, Dict
+from functools import lru_cache
+from io import BytesIO
+from typing import Dict, Optional
 
-import requests
-from pydantic import BaseModel  # pylint: disable=no-name-in-module
+import aiohttp
+from PIL import Image
 from watermark import File, Position, Watermark, apply_watermark
 
-from tgcf.plugin_models import MarkConfig
-from tgcf.plugins import TgcfMessage, TgcfPlugin
+from tgcf.config import CONFIG
+from tgcf.plugin_models import FileType
+from tgcf.plugins import TgcfMessage, TgcfPlugin, offload
 from tgcf.utils import cleanup
 
+# the overlay is scaled once for each of these media widths,
+# a media is watermarked with the variant for the nearest width above its own
+WIDTHS = (320, 480, 640, 720, 960, 1080, 1280, 1920, 2560, 3840)
 
-def download_image(url: str, filename: str = "image.png") -> bool:
-    if filename in os.listdir():
-        logging.info("Image for watermarking already exists.")
-        return True
-    try:
-        logging.info(f"Downloading image {url}")
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            logging.info("Got Response 200")
-            with open(filename, "wb") as file:
-                response.raw.decode_content = True
-                shutil.copyfileobj(response.raw, file)
-    except Exception as err:
-        logging.error(err)
-        return False
-    else:
-        logging.info("File created image")
-        return True
+
+async def fetch_image(url: str) -> bytes:
+    logging.info(f"Downloading image {url}")
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            return await response.read()
+
+
+@lru_cache(maxsize=32)
+def get_watermark(overlay: str, position: Position) -> Watermark:
+    """Return the watermark for an overlay, made once per process."""
+    return Watermark(File(overlay), position)
+
+
+def watermark(file: str, overlay: str, position: Position, frame_rate: int) -> str:
+    """Watermark an image or video, returning the new file. Runs in the executor."""
+    wtm = get_watermark(overlay, position)
+    return apply_watermark(File(file), wtm, frame_rate=frame_rate)
 
 
 class TgcfMark(TgcfPlugin):
     id_ = "mark"
+    file_types = frozenset({FileType.GIF, FileType.VIDEO, FileType.PHOTO})
 
     def __init__(self, data) -> None:
         self.data = data
+        self.overlay: Optional[Image.Image] = None
+        # media width -> path of the overlay scaled for it
+        self.variants: Dict[int, str] = {}
+        self.folder = os.path.join(CONFIG.media.cache_dir, "mark")
+
+    async def __ainit__(self) -> None:
+        """Get the overlay once, and scale it for the common media widths."""
+        try:
+            if self.data.image.startswith("https://"):
+                content = await fetch_image(self.data.image)
+            else:
+                with open(self.data.image, "rb") as file:
+                    content = file.read()
+            self.overlay = Image.open(BytesIO(content))
+            self.overlay.load()
+            await asyncio.to_thread(self.prescale)
+        except Exception as err:
+            logging.error(f"Could not load the watermark {self.data.image}. \n {err}")
+            return
+        logging.info(f"Watermark ready in {len(self.variants)} sizes")
+
+    def prescale(self) -> None:
+        os.makedirs(self.folder, exist_ok=True)
+        if not self.data.scale:
+            self.variants[0] = self.save(self.overlay, "overlay.png")
+            return
+        ratio = self.overlay.height / self.overlay.width
+        for width in WIDTHS:
+            w = max(1, round(width * self.data.scale))
+            scaled = self.overlay.resize((w, max(1, round(w * ratio))), Image.LANCZOS)
+            self.variants[width] = self.save(scaled, f"overlay_{width}.png")
+
+    def save(self, image: Image.Image, name: str) -> str:
+        path = os.path.join(self.folder, name)
+        image.save(path, format="PNG")
+        return path
+
+    def overlay_for(self, width: Optional[int]) -> str:
+        """Return the overlay variant for a media of the given width."""
+        if not self.variants:
+            raise RuntimeError("The watermark image could not be loaded")
+        if not self.data.scale:
+            return self.variants[0]
+        for common in WIDTHS:
+            if width and width <= common:
+                return self.variants[common]
+        return self.variants[WIDTHS[-1]]
 
     async def modify(self, tm: TgcfMessage) -> TgcfMessage:
-        if not tm.file_type in ["gif", "video", "photo"]:
+        if tm.file_type not in self.file_types:
             return tm
+        overlay = self.overlay_for(tm.message.file.width)
         downloaded_file = await tm.get_file()
-        base = File(downloaded_file)
-        if self.data.image.startswith("https://"):
-            download_image(self.data.image)
-            overlay = File("image.png")
-        else:
-            overlay = File(self.data.image)
-        wtm = Watermark(overlay, self.data.position)
-        tm.new_file = apply_watermark(base, wtm, frame_rate=self.data.frame_rate)
-        cleanup(downloaded_file)
+        try:
+            tm.new_file = await offload(
+                watermark,
+                downloaded_file,
+                overlay,
+                self.data.position,
+                self.data.frame_rate,
+            )
+        finally:
+            cleanup(downloaded_file)
         tm.cleanup = True
         return tm
@@ -1,22 +1,31 @@
 import pytesseract
 from PIL import Image
 
-from tgcf.plugins import TgcfMessage, TgcfPlugin
+from tgcf.plugin_models import FileType
+from tgcf.plugins import TgcfMessage, TgcfPlugin, offload
 from tgcf.utils import cleanup
 
 
+def read_text(file: str) -> str:
+    """Return the text in an image. Runs in the executor."""
+    return pytesseract.image_to_string(Image.open(file))
+
+
 class TgcfOcr(TgcfPlugin):
     id_ = "ocr"
+    file_types = frozenset({FileType.PHOTO})
 
     def __init__(self, data) -> None:
         pass
 
     async def modify(self, tm: TgcfMessage) -> TgcfMessage:
 
-        if not tm.file_type in ["photo"]:
+        if tm.file_type not in self.file_types:
             return tm
 
         file = await tm.get_file()
-        tm.text = pytesseract.image_to_string(Image.open(file))
-        cleanup(file)
+        try:
+            tm.set_text(await offload(read_text, file))
+        finally:
+            cleanup(file)
         return tm
@@ -1,25 +1,93 @@
 import logging
-from typing import Any, Dict
+import re
+from typing import Dict, List, Optional, Pattern, Tuple
 
-from pydantic import BaseModel  # pylint: disable=no-name-in-module
+from telethon.tl.types import TypeMessageEntity
 
-from tgcf.plugin_models import Replace
+from tgcf.entities import Edit, parse_markdown, style_entity, utf16_len
+from tgcf.plugin_models import STYLE_CODES, Replace
 from tgcf.plugins import TgcfMessage, TgcfPlugin
-from tgcf.utils import replace
+
+
+def style_matches(pattern: Pattern, style: str, text: str) -> List[TypeMessageEntity]:
+    """Return the entities formatting every match in the style (bold, ...)."""
+    entities = []
+    pos = pos16 = 0
+    for matched in pattern.finditer(text):
+        pos16 += utf16_len(text[pos : matched.start()])
+        length = utf16_len(matched.group(0))
+        entity = style_entity(style, pos16, length)
+        if entity and length:
+            entities.append(entity)
+        pos16 += length
+        pos = matched.end()
+    return entities
+
+
+class Replacer:
+    """Apply many replacement rules, compiled once.
+
+    Plain strings are replaced in a single scan of the text: all of them are
+    merged into one alternation (longest first) and looked up in a table.
+    Regex rules are compiled once and applied in order, a rule whose
+    replacement is a style (bold, italics, ...) formatting the match.
+    The rules apply to the plain text, the formatting being moved along.
+    Replacements may use markdown, parsed once for plain rules, and after
+    expanding the groups for regex rules.
+    """
+
+    def __init__(self, rules: Dict[str, str], regex: bool) -> None:
+        self.plain: Optional[Pattern] = None
+        self.table: Dict[str, Tuple[str, List[TypeMessageEntity]]] = {}
+        self.ordered: List[Tuple[Pattern, str]] = []
+        if regex:
+            for pattern, new in rules.items():
+                try:
+                    compiled = re.compile(pattern)
+                except re.error as err:
+                    logging.error(f"Invalid pattern {pattern} is ignored. \n {err}")
+                    continue
+                self.ordered.append((compiled, new))
+            return
+        self.table = {old: parse_markdown(new) for old, new in rules.items() if old}
+        if self.table:
+            keys = sorted(self.table, key=len, reverse=True)
+            self.plain = re.compile("|".join(map(re.escape, keys)))
+
+    def apply(self, tm: TgcfMessage) -> None:
+        if self.plain:
+            tm.edit(
+                [
+                    Edit(m.start(), m.end(), *self.table[m.group(0)])
+                    for m in self.plain.finditer(tm.raw_text)
+                ]
+            )
+            return
+        for pattern, new in self.ordered:
+            if new in STYLE_CODES:
+                tm.add_entities(style_matches(pattern, new, tm.raw_text))
+            else:
+                tm.edit(
+                    [
+                        Edit(m.start(), m.end(), *parse_markdown(m.expand(new)))
+                        for m in pattern.finditer(tm.raw_text)
+                    ]
+                )
 
 
 class TgcfReplace(TgcfPlugin):
     id_ = "replace"
 
     def __init__(self, data):
-        self.replace = data
+        self.replace: Replace = data
+        self.replacer = Replacer(self.replace.text, self.replace.regex)
         logging.info(self.replace)
 
+    def is_noop(self) -> bool:
+        return not (self.replacer.table or self.replacer.ordered)
+
     def modify(self, tm: TgcfMessage) -> TgcfMessage:
-        msg_text: str = tm.text
-        if not msg_text:
+        if not tm.raw_text:
             return tm
-        for original, new in self.replace.text.items():
-            msg_text = replace(original, new, msg_text, self.replace.regex)
-        tm.text = msg_text
+        self.replacer.apply(tm)
         return tm
@@ -1,31 +1,38 @@
 import logging
-import sys
 
+from tgcf.clients import start_client
 from tgcf.plugins import TgcfMessage, TgcfPlugin
-from tgcf.config import CONFIG, get_SESSION
-from telethon import TelegramClient
+from tgcf.config import CONFIG
+from tgcf.media import upload_media
+from tgcf.plugin_models import FileType
 
 class TgcfSender(TgcfPlugin):
     id_ = "sender"
     
     async def __ainit__(self) -> None:
-        sender = TelegramClient(
-            get_SESSION(CONFIG.plugins.sender, 'tgcf_sender'),
-            CONFIG.login.API_ID,
-            CONFIG.login.API_HASH,
-        )
-        if self.data.user_type == 0:
-            if self.data.BOT_TOKEN == "":
-                logging.warning("[Sender] Bot token not found, but login type is set to bot.")
-                sys.exit()
-            await sender.start(bot_token=self.data.BOT_TOKEN)
-        else:
-            await sender.start()
-        self.sender = sender
+        self.sender = await start_client(CONFIG.plugins.sender, "tgcf_sender")
 
     async def modify(self, tm: TgcfMessage) -> TgcfMessage:
         tm.client = self.sender
-        if tm.file_type != "nofile":
+        # a file made by an earlier plugin (like mark) is uploaded as it is
+        if tm.file_type == FileType.NOFILE or tm.new_file is not None:
+            return tm
+        if CONFIG.server_copy and not CONFIG.show_forwarded_from:
+            # only needed if telegram can not copy the media, see utils.can_copy
+            tm.transfer = self.transfer
+            return tm
+        await self.transfer(tm)
+        return tm
+
+    async def transfer(self, tm: TgcfMessage) -> None:
+        """Make the media of the message available to the sender client."""
+        if self.data.stream_media:
+            try:
+                tm.new_file = await upload_media(
+                    tm.message, self.sender, self.data.buffer_parts
+                )
+            except Exception as err:
+                logging.warning(f"[Sender] Could not stream media, downloading it. \n {err}")
+        if tm.new_file is None:
             tm.new_file = await tm.get_file()
-            tm.cleanup = True
-        return tm
\ No newline at end of file
+            tm.cleanup = True
\ No newline at end of file
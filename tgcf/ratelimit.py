@@ -0,0 +1,142 @@
+"""Adaptive rate limiting of sends, shared by live and past mode.
+
+Every send waits for a token from the bucket of the client sending it and from
+the bucket of the destination. When Telegram answers with a flood wait, both
+rates are lowered, and raised back step by step after a quiet period.
+"""
+
+import asyncio
+import logging
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from telethon import TelegramClient
+from telethon.errors.rpcerrorlist import FloodWaitError
+
+from tgcf.config import CONFIG, RateLimitSettings
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average, adapting to flood waits.
+
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate: float, settings: RateLimitSettings) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.settings = settings
+        self.tokens = max(1.0, rate)
+        self.updated = time.monotonic()
+        self.last_change = self.updated
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def _recover(self, now: float) -> None:
+        if self.rate >= self.max_rate:
+            return
+        if now - self.last_change >= self.settings.recover_after:
+            self.rate = min(self.max_rate, self.rate / self.settings.backoff)
+            self.last_change = now
+            logging.info(f"Rate limit raised to {self.rate:.2f}/s")
+
+    async def acquire(self) -> None:
+        """Wait until a request may be sent."""
+        if self.max_rate <= 0:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            self._recover(now)
+            self._refill(now)
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill(time.monotonic())
+            self.tokens -= 1
+
+    def penalize(self) -> None:
+        """Lower the rate after a flood wait."""
+        if self.max_rate <= 0:
+            return
+        self.rate = max(self.settings.min_rate, self.rate * self.settings.backoff)
+        self.tokens = 0
+        self.last_change = time.monotonic()
+        logging.info(f"Rate limit lowered to {self.rate:.2f}/s")
+
+
+class RateLimiter:
+    """Hold a token bucket per client and per destination."""
+
+    def __init__(self, settings: RateLimitSettings) -> None:
+        self.settings = settings
+        self.clients: "weakref.WeakKeyDictionary[TelegramClient, TokenBucket]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.dests: Dict[Hashable, TokenBucket] = {}
+
+    def client_bucket(self, client: TelegramClient) -> TokenBucket:
+        bucket = self.clients.get(client)
+        if bucket is None:
+            bucket = TokenBucket(self.settings.per_client, self.settings)
+            self.clients[client] = bucket
+        return bucket
+
+    def dest_bucket(self, dest: Hashable) -> TokenBucket:
+        bucket = self.dests.get(dest)
+        if bucket is None:
+            bucket = TokenBucket(self.settings.per_dest, self.settings)
+            self.dests[dest] = bucket
+        return bucket
+
+    async def call(
+        self,
+        client: TelegramClient,
+        dest: Hashable,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        """Await `func(*args, **kwargs)` once allowed, retrying on flood waits.
+
+        Telethon itself sleeps through flood waits shorter than the client's
+        `flood_sleep_threshold`; only longer ones reach here.
+        """
+        for attempt in range(self.settings.retries + 1):
+            try:
+                return await self.call_once(client, dest, func, *args, **kwargs)
+            except FloodWaitError as fwe:
+                if attempt == self.settings.retries:
+                    raise
+                await asyncio.sleep(fwe.seconds)
+
+    async def call_once(
+        self,
+        client: TelegramClient,
+        dest: Hashable,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        """Await `func(*args, **kwargs)` once allowed.
+
+        On a flood wait, the rates are lowered and the error is raised.
+        """
+        client_bucket = self.client_bucket(client)
+        dest_bucket = self.dest_bucket(dest)
+        await client_bucket.acquire()
+        await dest_bucket.acquire()
+        try:
+            return await func(*args, **kwargs)
+        except FloodWaitError as fwe:
+            logging.warning(f"Flood wait of {fwe.seconds}s sending to {dest}")
+            client_bucket.penalize()
+            dest_bucket.penalize()
+            raise
+
+
+limiter = RateLimiter(CONFIG.rate_limit)
@@ -1,35 +1,282 @@
-from typing import Dict
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional
 
 from pymongo.collection import Collection
-from telethon.tl.custom.message import Message
 
+from tgcf.cache import LRUCache
+from tgcf.const import KEEP_LAST_MANY
 
-class EventUid:
-    """The objects of this class uniquely identifies a message with its chat id and message id."""
 
-    def __init__(self, event) -> None:
-        self.chat_id = event.chat_id
-        try:
-            self.msg_id = event.id
-        except:  # pylint: disable=bare-except
-            self.msg_id = event.deleted_id
+class EventUid(NamedTuple):
+    """Uniquely identifies a message with its chat id and message id.
+
+    Being a tuple of two ints, it is immutable, small, and hashes and compares
+    without allocating anything.
+    """
+
+    chat_id: int
+    msg_id: int
 
     def __str__(self) -> str:
         return f"chat={self.chat_id} msg={self.msg_id}"
 
-    def __eq__(self, other) -> bool:
-        return self.chat_id == other.chat_id and self.msg_id == other.msg_id
 
-    def __hash__(self) -> int:
-        return hash(self.__str__())
+class Sent(NamedTuple):
+    """A message sent in a destination, and the account that sent it.
+
+    `account` is the user id of the pool account, or 0 for the client that
+    sends when there is no pool. Only that account can edit or delete it.
+    """
+
+    msg_id: int
+    account: int = 0
+
+
+class MappingStore:
+    """Map a message in a source to the messages sent for it in the destinations.
+
+    A mapping is `EventUid -> {dest_chat_id: Sent}`.
+    This store keeps mappings in memory only, in an LRU cache bounded by
+    `limit` entries and `max_bytes` (0: unbounded). Looking up a mapping
+    (like for a reply or an edit) marks it as recently used.
+    """
+
+    def __init__(self, limit: int = KEEP_LAST_MANY, max_bytes: int = 0) -> None:
+        self.data = LRUCache(limit, max_bytes)
+
+    def get(
+        self, uid: EventUid, default: Optional[Dict[int, Sent]] = None
+    ) -> Optional[Dict[int, Sent]]:
+        return self.data.get(uid, default)
+
+    def __getitem__(self, uid: EventUid) -> Dict[int, Sent]:
+        dests = self.get(uid)
+        if dests is None:
+            raise KeyError(uid)
+        return dests
+
+    def __contains__(self, uid: EventUid) -> bool:
+        return uid in self.data
+
+    def __setitem__(self, uid: EventUid, dests: Dict[int, Sent]) -> None:
+        self.data[uid] = dests
+
+    def __delitem__(self, uid: EventUid) -> None:
+        self.data.pop(uid)
+
+    def remove(self, uids: Iterable[EventUid]) -> None:
+        """Forget the mappings of many messages at once."""
+        for uid in uids:
+            self.data.pop(uid)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __iter__(self) -> Iterator[EventUid]:
+        return iter(self.data)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the counters of the in-memory cache."""
+        return self.data.stats()
+
+    def flush(self) -> None:
+        """Persist pending writes, if the store is persistent."""
+
+    async def keep_flushing(self) -> None:
+        """Flush pending writes periodically, for stores that batch them."""
+
+    def close(self) -> None:
+        """Flush and release resources."""
+        self.flush()
+
+
+class SqliteMappingStore(MappingStore):
+    """Persist mappings in a SQLite database, so that syncs survive restarts.
+
+    Writes are batched and flushed every `batch_size` mappings or `flush_interval`
+    seconds. Recently used mappings are served from the in-memory LRU cache.
+    Mappings older than `ttl` seconds are pruned.
+    """
+
+    PRUNE_EVERY = 3600  # seconds
+
+    def __init__(
+        self,
+        path: str,
+        limit: int = KEEP_LAST_MANY,
+        max_bytes: int = 0,
+        ttl: int = 0,
+        batch_size: int = 100,
+        flush_interval: float = 5,
+    ) -> None:
+        super().__init__(limit, max_bytes)
+        self.path = path
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending: Dict[EventUid, Dict[int, Sent]] = {}
+        self.last_flush = time.monotonic()
+        self.last_prune = 0.0
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS mapping (
+                src_chat INTEGER NOT NULL,
+                src_msg INTEGER NOT NULL,
+                dest_chat INTEGER NOT NULL,
+                dest_msg INTEGER NOT NULL,
+                created INTEGER NOT NULL,
+                account INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (src_chat, src_msg, dest_chat)
+            ) WITHOUT ROWID"""
+        )
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(mapping)")]
+        if "account" not in columns:
+            # databases made before the pool of accounts
+            self.db.execute(
+                "ALTER TABLE mapping ADD COLUMN account INTEGER NOT NULL DEFAULT 0"
+            )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS mapping_created ON mapping (created)"
+        )
+        self.db.commit()
+        self.prune()
+
+    def get(
+        self, uid: EventUid, default: Optional[Dict[int, Sent]] = None
+    ) -> Optional[Dict[int, Sent]]:
+        dests = self.data.get(uid)
+        if dests is not None:
+            return dests
+        dests = self.pending.get(uid)
+        if dests is not None:
+            return dests
+        rows = self.db.execute(
+            "SELECT dest_chat, dest_msg, account FROM mapping"
+            " WHERE src_chat=? AND src_msg=?",
+            (uid.chat_id, uid.msg_id),
+        ).fetchall()
+        if not rows:
+            return default
+        dests = {
+            dest_chat: Sent(msg_id, account) for dest_chat, msg_id, account in rows
+        }
+        self.data[uid] = dests
+        return dests
+
+    def __contains__(self, uid: EventUid) -> bool:
+        return self.get(uid) is not None
+
+    def __setitem__(self, uid: EventUid, dests: Dict[int, Sent]) -> None:
+        self.data[uid] = dests
+        self.pending[uid] = dests
+        if (
+            len(self.pending) >= self.batch_size
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def __delitem__(self, uid: EventUid) -> None:
+        self.data.pop(uid, None)
+        self.pending.pop(uid, None)
+        self.db.execute(
+            "DELETE FROM mapping WHERE src_chat=? AND src_msg=?",
+            (uid.chat_id, uid.msg_id),
+        )
+        self.db.commit()
+
+    def remove(self, uids: Iterable[EventUid]) -> None:
+        uids = list(uids)
+        for uid in uids:
+            self.data.pop(uid)
+            self.pending.pop(uid, None)
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM mapping WHERE src_chat=? AND src_msg=?", uids
+            )
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.db.execute(
+            "SELECT COUNT(*) FROM (SELECT DISTINCT src_chat, src_msg FROM mapping)"
+        ).fetchone()[0]
+
+    def __iter__(self) -> Iterator[EventUid]:
+        self.flush()
+        rows = self.db.execute("SELECT DISTINCT src_chat, src_msg FROM mapping")
+        for chat_id, msg_id in rows.fetchall():
+            yield EventUid(chat_id, msg_id)
+
+    def flush(self) -> None:
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        now = int(time.time())
+        rows = [
+            (uid.chat_id, uid.msg_id, dest_chat, sent.msg_id, now, sent.account)
+            for uid, dests in self.pending.items()
+            for dest_chat, sent in dests.items()
+        ]
+        uids = list(self.pending)
+        self.pending = {}
+        with self.db:
+            # a message stored again may have fewer destinations than before
+            self.db.executemany(
+                "DELETE FROM mapping WHERE src_chat=? AND src_msg=?", uids
+            )
+            self.db.executemany("INSERT INTO mapping VALUES (?, ?, ?, ?, ?, ?)", rows)
+        if time.monotonic() - self.last_prune >= self.PRUNE_EVERY:
+            self.prune()
+
+    async def keep_flushing(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def prune(self) -> None:
+        """Delete mappings older than the ttl."""
+        self.last_prune = time.monotonic()
+        if self.ttl <= 0:
+            return
+        with self.db:
+            deleted = self.db.execute(
+                "DELETE FROM mapping WHERE created < ?", (int(time.time()) - self.ttl,)
+            ).rowcount
+        if deleted:
+            logging.info(f"Pruned {deleted} expired message mappings")
+
+    def close(self) -> None:
+        self.flush()
+        self.db.close()
+        logging.info(f"Message mapping cache stats {self.stats()}")
+
+
+def reply_ids(uid: EventUid) -> Dict[int, int]:
+    """Return the id of the copy of a message in each destination, to reply to."""
+    return {dest: sent.msg_id for dest, sent in stored.get(uid, {}).items()}
 
 
-class DummyEvent:
-    def __init__(self, chat_id, msg_id):
-        self.chat_id = chat_id
-        self.id = msg_id
+def open_store(settings) -> MappingStore:
+    """Create the mapping store configured in `settings` (a MappingSettings)."""
+    if settings.backend == "sqlite":
+        logging.info(f"Storing message mappings in {settings.path}")
+        return SqliteMappingStore(
+            settings.path,
+            limit=settings.cache_size,
+            max_bytes=settings.cache_bytes,
+            ttl=settings.ttl_days * 24 * 3600,
+            batch_size=settings.batch_size,
+            flush_interval=settings.flush_interval,
+        )
+    return MappingStore(settings.cache_size, settings.cache_bytes)
 
 
-stored: Dict[EventUid, Dict[int, Message]] = {}
+stored: MappingStore = MappingStore()
 CONFIG_TYPE: int = 0
 mycol: Collection = None
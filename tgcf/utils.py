@@ -1,20 +1,33 @@
 """Utility functions to smoothen your life."""
 
+import asyncio
 import logging
 import os
 import platform
 import re
 import sys
+import weakref
 from datetime import datetime
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Union
 
 from telethon.client import TelegramClient
+from telethon.errors import (
+    ChannelInvalidError,
+    ChannelPrivateError,
+    ChatForwardsRestrictedError,
+    FloodWaitError,
+    MessageIdInvalidError,
+    RPCError,
+)
 from telethon.hints import EntityLike
 from telethon.tl.custom.message import Message
+from telethon.tl.types import PeerChannel
+from telethon.utils import resolve_id
 
 from tgcf import __version__
+from tgcf.clients import pool
 from tgcf.config import CONFIG
-from tgcf.plugin_models import STYLE_CODES
+from tgcf.storage import Sent
 
 if TYPE_CHECKING:
     from tgcf.plugins import TgcfMessage
@@ -29,18 +42,247 @@ def platform_info():
     \n{platform.architecture()} {platform.processor()}"""
 
 
-async def send_message(recipient: EntityLike, tm: "TgcfMessage") -> Message:
-    """Forward or send a copy, depending on config."""
+def movable(
+    recipient: EntityLike, tms: List["TgcfMessage"], reply_to: Optional[int]
+) -> bool:
+    """Check if any client can send messages, not only the one they are for.
+
+    Forwards and media held by a client (by reference or uploaded) can not be
+    sent by another. Text, and files saved by plugins, can. Only channels and
+    supergroups qualify, and not for replies: in other chats, message ids
+    differ between accounts.
+    """
+    if CONFIG.show_forwarded_from or reply_to is not None:
+        return False
+    if not isinstance(recipient, int) or resolve_id(recipient)[1] is not PeerChannel:
+        return False
+    return all(
+        isinstance(tm.new_file, str) or (tm.new_file is None and not tm.message.file)
+        for tm in tms
+    )
+
+
+async def send_message(
+    recipient: EntityLike, tm: "TgcfMessage", reply_to: Optional[int] = None
+) -> Message:
+    """Forward or send a copy, depending on config.
+
+    `reply_to` overrides `tm.reply_to`, so that one TgcfMessage can be sent
+    to many destinations at once, each replying to its own message.
+    """
     client: TelegramClient = tm.client
+    if reply_to is None:
+        reply_to = tm.reply_to
+    return await pool.call(
+        recipient,
+        client,
+        movable(recipient, [tm], reply_to),
+        _send_message,
+        recipient,
+        tm,
+        reply_to,
+    )
+
+
+# errors telling that a client can not copy from a chat at all
+SOURCE_ERRORS = (
+    ChannelInvalidError,
+    ChannelPrivateError,
+    ChatForwardsRestrictedError,
+    MessageIdInvalidError,
+)
+
+# the chats each client could not copy messages from
+_copy_denied: "weakref.WeakKeyDictionary[TelegramClient, Set[int]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def can_copy(
+    client: TelegramClient, tms: List["TgcfMessage"], reply_to: Optional[int]
+) -> bool:
+    """Check if telegram can copy the media of messages, instead of tgcf.
+
+    Only useful when the media would have to be moved to another client (like
+    the one of the sender plugin): a client sends the media of its own messages
+    by reference. Then, no plugin must have made a new file, the chat must not
+    protect its content, and the client must not have failed to copy from the
+    chat before. Only messages of channels (and supergroups) can be copied, as
+    the ids of other messages differ between accounts. Copies can not be
+    replies, as telethon does not forward as a reply.
+    """
+    if not CONFIG.server_copy or reply_to is not None:
+        return False
+    denied = _copy_denied.get(client, ())
+    return all(
+        client is not tm.message.client
+        and tm.new_file is None
+        and tm.message.file is not None
+        and tm.message.is_channel
+        and not tm.message.noforwards
+        and tm.message.chat_id not in denied
+        for tm in tms
+    )
+
+
+async def copy_messages(
+    client: TelegramClient, recipient: EntityLike, tms: List["TgcfMessage"]
+) -> Optional[List[Message]]:
+    """Forward messages without their author, so the media stays on telegram.
+
+    Captions changed by plugins are dropped, then set by editing the copies.
+    Returns None if the messages could not be copied. The chat is not tried
+    again only if the error came from it, not from the recipient.
+    """
+    chat_id = tms[0].message.chat_id
+    changed = any(tm.text_changed for tm in tms)
+    try:
+        source = await client.get_input_entity(chat_id)
+    except ValueError as err:
+        logging.info(f"Can not copy messages from {chat_id}, sending them. \n {err}")
+        _copy_denied.setdefault(client, set()).add(chat_id)
+        return None
+    try:
+        sent = await client.forward_messages(
+            recipient,
+            [tm.message.id for tm in tms],
+            source,
+            drop_author=True,
+            drop_media_captions=changed,
+        )
+    except FloodWaitError:
+        raise
+    except SOURCE_ERRORS as err:
+        logging.info(f"Can not copy messages from {chat_id}, sending them. \n {err}")
+        _copy_denied.setdefault(client, set()).add(chat_id)
+        return None
+    except (RPCError, ValueError) as err:
+        logging.info(f"Copying messages from {chat_id} failed, sending them. \n {err}")
+        return None
+    if changed:
+        for i, tm in enumerate(tms):
+            if sent[i] and tm.raw_text:
+                sent[i] = await client.edit_message(
+                    recipient,
+                    sent[i],
+                    tm.raw_text,
+                    formatting_entities=tm.entities,
+                    parse_mode=None,
+                )
+    return sent
+
+
+async def _send_message(
+    client: TelegramClient,
+    recipient: EntityLike,
+    tm: "TgcfMessage",
+    reply_to: Optional[int],
+) -> Message:
     if CONFIG.show_forwarded_from:
         return await client.forward_messages(recipient, tm.message)
+    if can_copy(client, [tm], reply_to):
+        sent = await copy_messages(client, recipient, [tm])
+        if sent:
+            return sent[0]
+    await tm.fetch_media()
     if tm.new_file:
         message = await client.send_file(
-            recipient, tm.new_file, caption=tm.text, reply_to=tm.reply_to
+            recipient,
+            tm.new_file,
+            caption=tm.raw_text,
+            formatting_entities=tm.entities,
+            parse_mode=None,
+            reply_to=reply_to,
         )
         return message
-    tm.message.text = tm.text
-    return await client.send_message(recipient, tm.message, reply_to=tm.reply_to)
+    if tm.text_changed:
+        # the entities are sent as they are, no markdown is parsed
+        tm.message.message = tm.raw_text
+        tm.message.entities = tm.entities
+    return await client.send_message(recipient, tm.message, reply_to=reply_to)
+
+
+async def send_album(
+    recipient: EntityLike, tms: List["TgcfMessage"], reply_to: Optional[int] = None
+) -> List[Message]:
+    """Send many messages in a single request.
+
+    The messages of an album are sent as one group. When showing forwarded from,
+    any batch of up to 100 messages is forwarded at once.
+    Returns the messages sent, in the same order as `tms`.
+    """
+    if len(tms) == 1:
+        return [await send_message(recipient, tms[0], reply_to=reply_to)]
+    client: TelegramClient = tms[0].client
+    if reply_to is None:
+        reply_to = tms[0].reply_to
+    return await pool.call(
+        recipient,
+        client,
+        movable(recipient, tms, reply_to),
+        _send_album,
+        recipient,
+        tms,
+        reply_to,
+    )
+
+
+async def _send_album(
+    client: TelegramClient,
+    recipient: EntityLike,
+    tms: List["TgcfMessage"],
+    reply_to: Optional[int],
+) -> List[Message]:
+    if CONFIG.show_forwarded_from:
+        return await client.forward_messages(recipient, [tm.message for tm in tms])
+    if can_copy(client, tms, reply_to):
+        sent = await copy_messages(client, recipient, tms)
+        if sent:
+            return sent
+    for tm in tms:
+        await tm.fetch_media()
+    files = [tm.new_file or tm.message.media for tm in tms]
+    return await client.send_file(
+        recipient,
+        files,
+        caption=[tm.raw_text for tm in tms],
+        formatting_entities=[tm.entities for tm in tms],
+        parse_mode=None,
+        reply_to=reply_to,
+    )
+
+
+def record(message: Message) -> Sent:
+    """Return what to store of a message sent in a destination."""
+    return Sent(message.id, pool.account(message.client))
+
+
+async def fan_out(
+    dest: List[int],
+    tm: Union["TgcfMessage", List["TgcfMessage"]],
+    reply_to: Dict[int, int],
+) -> Dict[int, Union[Message, List[Message]]]:
+    """Send a message, or an album (list of messages), to all destinations concurrently.
+
+    At most `CONFIG.live.max_concurrent_sends` requests are in flight per client,
+    counted for the client each send goes through (see `ClientPool.call`).
+    A failure in one destination does not affect the others.
+
+    Returns:
+        Dict: key = chat id of destination
+                value = what was sent there (missing if sending failed)
+    """
+    send = send_album if isinstance(tm, list) else send_message
+    results = await asyncio.gather(
+        *(send(d, tm, reply_to=reply_to.get(d)) for d in dest), return_exceptions=True
+    )
+    sent = {}
+    for d, result in zip(dest, results):
+        if isinstance(result, BaseException):
+            logging.error(f"Failed to send message to {d}. \n {result}")
+            continue
+        sent[d] = result
+    return sent
 
 
 def cleanup(*files: str) -> None:
@@ -71,27 +313,6 @@ def safe_name(string: str) -> str:
     return re.sub(pattern=r"[-!@#$%^&*()\s]", repl="_", string=string)
 
 
-def match(pattern: str, string: str, regex: bool) -> bool:
-    if regex:
-        return bool(re.findall(pattern, string))
-    return pattern in string
-
-
-def replace(pattern: str, new: str, string: str, regex: bool) -> str:
-    def fmt_repl(matched):
-        style = new
-        s = STYLE_CODES.get(style)
-        return f"{s}{matched.group(0)}{s}"
-
-    if regex:
-        if new in STYLE_CODES:
-            compliled_pattern = re.compile(pattern)
-            return compliled_pattern.sub(repl=fmt_repl, string=string)
-        return re.sub(pattern, new, string)
-    else:
-        return string.replace(pattern, new)
-
-
 def clean_session_files():
     for item in os.listdir():
         if item.endswith(".session") or item.endswith(".session-journal"):
@@ -1,6 +1,6 @@
 import streamlit as st
 
-from tgcf.config import CONFIG, read_config, write_config
+from tgcf.config import CONFIG, PoolAccount, read_config, write_config
 from tgcf.web_ui.password import check_password
 from tgcf.web_ui.utils import hide_st, switch_theme
 
@@ -56,5 +56,20 @@ if check_password(st):
             """
             )
 
+    with st.expander("Extra bots to share the sending load"):
+        st.write(
+            "These bots send messages too, in the destinations where they can post. One bot token per line."
+        )
+        tokens = st.text_area(
+            "Bot tokens",
+            value="\n".join(a.BOT_TOKEN for a in CONFIG.login.pool if a.user_type == 0),
+        )
+        users = [a for a in CONFIG.login.pool if a.user_type == 1]
+        CONFIG.login.pool = users + [
+            PoolAccount(BOT_TOKEN=token.strip())
+            for token in tokens.splitlines()
+            if token.strip()
+        ]
+
     if st.button("Save"):
         write_config(CONFIG)
@@ -92,6 +92,12 @@ if check_password(st):
             "Apply watermark to media (images and videos).",
             value=CONFIG.plugins.mark.check,
         )
+        CONFIG.plugins.mark.scale = st.slider(
+            "Width of the watermark, relative to the media (0 to keep its own size)",
+            min_value=0.0,
+            max_value=1.0,
+            value=float(CONFIG.plugins.mark.scale),
+        )
         uploaded_file = st.file_uploader("Upload watermark image(png)", type=["png"])
         if uploaded_file is not None:
             with open("image.png", "wb") as f:
@@ -169,6 +175,10 @@ if check_password(st):
         CONFIG.plugins.sender.check = st.checkbox(
             "Set sender to:", value=CONFIG.plugins.sender.check
         )
+        CONFIG.plugins.sender.stream_media = st.checkbox(
+            "Stream media without saving it to disk",
+            value=CONFIG.plugins.sender.stream_media,
+        )
         leftpad,content,rightpad = st.columns([0.05,0.9,0.05])
         with content:
             user_type = st.radio("Account Type", ["Bot", "User"], index=CONFIG.plugins.sender.user_type,horizontal=True)
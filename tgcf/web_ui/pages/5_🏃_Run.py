@@ -37,6 +37,10 @@ if check_password(st):
         CONFIG.show_forwarded_from = st.checkbox(
             "Show 'Forwarded from'", value=CONFIG.show_forwarded_from
         )
+        CONFIG.server_copy = st.checkbox(
+            "Copy media without downloading it, when possible",
+            value=CONFIG.server_copy,
+        )
         mode = st.radio("Choose mode", ["live", "past"], index=CONFIG.mode)
         if mode == "past":
             CONFIG.mode = 1
@@ -46,6 +50,12 @@ if check_password(st):
             CONFIG.past.delay = st.slider(
                 "Delay in seconds", 0, 100, value=CONFIG.past.delay
             )
+            CONFIG.past.batch_size = st.slider(
+                "Messages forwarded per request (with 'Forwarded from')",
+                1,
+                100,
+                value=CONFIG.past.batch_size,
+            )
         else:
             CONFIG.mode = 0
             CONFIG.live.delete_sync = st.checkbox(
@@ -45,6 +45,28 @@ if check_password(st):
             st.write(
                 "When you edit the message in source to something particular, the message will be deleted in both source and destinations."
             )
+            CONFIG.live.concurrent_fanout = st.checkbox(
+                "Send to all destinations concurrently",
+                value=CONFIG.live.concurrent_fanout,
+            )
+            CONFIG.live.max_concurrent_sends = st.number_input(
+                "Maximum concurrent sends per account",
+                min_value=1,
+                value=CONFIG.live.max_concurrent_sends,
+            )
+            CONFIG.live.workers = st.number_input(
+                "Number of workers handling sources in parallel",
+                min_value=0,
+                value=CONFIG.live.workers,
+            )
+            CONFIG.live.queue_size = st.number_input(
+                "Maximum queued updates per source",
+                min_value=0,
+                value=CONFIG.live.queue_size,
+            )
+            st.write(
+                "With 0 workers every update is handled as soon as it arrives. Otherwise updates of a source are handled in order, and different sources are handled in parallel."
+            )
             if st.checkbox("Customize Bot Messages"):
                 st.info(
                     "Note: For userbots, the commands start with `.` instead of `/`, like `.start` and not `/start`"